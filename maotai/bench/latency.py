@@ -0,0 +1,105 @@
+import logging
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from maotai.bench.mock_server import MockJDServer, MockState, point_env_params_at
+from maotai.common.config import env_params, reset_settings
+from maotai.common.connection import ConnectionManager
+from maotai.common.seckill import Seckill
+from maotai.common.util import percentile
+from maotai.logger.logutil import logger
+
+
+def print_table(rows):
+    """
+    输出各项指标的百分位数
+    :param rows: [(指标名, [数据 ms, ...]), ...]
+    :return:
+    """
+    print(f"""{'指标':<28}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}""")
+    for name, values in rows:
+        print(f"""{name:<28}{len(values):>6}{percentile(values, 50):>10.3f}{percentile(values, 90):>10.3f}"""
+              f"""{percentile(values, 99):>10.3f}{max(values) if values else float('nan'):>10.3f}""")
+
+
+def set_buy_time(jd_ms):
+    """
+    把抢购时间设置为指定的京东服务器时间
+    :param jd_ms: 京东服务器时间戳 (ms)
+    :return:
+    """
+    env_params['BUY_TIME'] = datetime.fromtimestamp(jd_ms / 1000.0).strftime('%H:%M:%S.%f')[:-3]
+    reset_settings()
+
+
+def run(rounds=10, latency_ms=5.0, skew_ms=120.0, lead_ms=3000, script=None, prefetch=False):
+    """
+    在模拟服务器上多轮执行抢购, 统计触发误差与触发到提交的延迟
+    :param rounds: 轮数
+    :param latency_ms: 模拟服务器的处理延迟 (ms)
+    :param skew_ms: 模拟服务器时间相对本地的偏差 (ms)
+    :param lead_ms: 每轮从开始到抢购时间的间隔 (ms)
+    :param script: 每轮依次返回的提交结果码
+    :param prefetch: 是否开启流水线预取初始化信息
+    :return: [(指标名, [数据 ms, ...]), ...]
+    """
+    script = script or [0]
+    state = MockState(latency_ms, skew_ms, script)
+    server = MockJDServer(state=state).start()
+    point_env_params_at(env_params, server.base_url)
+    env_params['PREWARM_HOSTS'] = [server.netloc]
+    env_params['WARMUP_LEAD_MS'] = lead_ms / 2
+    env_params['PREFETCH_ENABLED'] = prefetch
+    reset_settings()
+    submit_path = urlsplit(env_params.get('SUBMIT_ORDER')).path
+
+    seckill = Seckill()
+    seckill.session_util.connection_manager = ConnectionManager(seckill.session, scheme='http')
+    # 模拟服务器不校验登录
+    seckill.qr_login.is_login = True
+
+    fire_errors, first_submit, success = [], [], []
+    try:
+        for _ in range(rounds):
+            state.reset(script)
+            seckill._invalidate_seckill_init_info()
+            set_buy_time(state.server_ms() + lead_ms)
+            result = seckill.buy()
+            done_ms = state.server_ms()
+            arrivals = state.arrivals(submit_path)
+            fire_errors.append(result.triggered_at_ms + skew_ms - result.buy_time_ms)
+            if arrivals:
+                first_submit.append(arrivals[0] - result.buy_time_ms)
+            else:
+                # 本轮没有提交到达服务器 (如抢购前停止), 不计入首次提交延迟
+                logger.warning(f"""本轮没有提交到达模拟服务器: {result.reason}""")
+            if result.success:
+                success.append(done_ms - result.buy_time_ms)
+    finally:
+        server.stop()
+    return [
+        ('Adjuster 触发误差', fire_errors),
+        ('触发 -> 首次提交到达', first_submit),
+        ('触发 -> 抢购成功', success),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基于本地模拟服务器的抢购延迟基准测试')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=5.0, help='模拟服务器处理延迟 (ms)')
+    parser.add_argument('--skew', type=float, default=120.0, help='模拟服务器时间偏差 (ms)')
+    parser.add_argument('--lead', type=int, default=3000, help='每轮等待时间 (ms)')
+    parser.add_argument('--script', default='0', help='每轮依次返回的提交结果码, 如 60017,90013,0')
+    parser.add_argument('--prefetch', action='store_true', help='开启流水线预取初始化信息')
+    parser.add_argument('--quiet', action='store_true', help='只输出警告以上的日志')
+    args = parser.parse_args()
+    if args.quiet:
+        logger.setLevel(logging.WARNING)
+    script = [int(code) for code in args.script.split(',') if code]
+    print_table(run(args.rounds, args.latency, args.skew, args.lead, script, args.prefetch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# 返回信息 (与 Seckill.submit_seckill_order 中记录的一致)
+SUBMIT_RESULTS = {
+    60074: {'errorMessage': '很遗憾没有抢到，再接再厉哦。', 'orderId': 0, 'resultCode': 60074, 'skuId': 0, 'success': False},
+    60017: {'errorMessage': '抱歉，您提交过快，请稍后再提交订单！', 'orderId': 0, 'resultCode': 60017, 'skuId': 0, 'success': False},
+    90013: {'errorMessage': '系统正在开小差，请重试~~', 'orderId': 0, 'resultCode': 90013, 'skuId': 0, 'success': False},
+    0: {'appUrl': '//mock/app', 'orderId': 820227000001, 'pcUrl': '//mock/pay', 'resultCode': 0, 'skuId': 0,
+        'success': True, 'totalMoney': '1499.00'},
+}
+
+SECKILL_INIT_INFO = {
+    'addressList': [{
+        'id': 1, 'name': 'mock', 'provinceId': 1, 'cityId': 2, 'countyId': 3, 'townId': 0,
+        'addressDetail': 'mock address', 'mobile': '138****0000', 'mobileKey': 'mock-key', 'email': '',
+    }],
+    'invoiceInfo': {'invoiceTitle': 4, 'invoiceContentType': 1, 'invoicePhone': '138****0000',
+                    'invoicePhoneKey': 'mock-key'},
+    'token': 'mock-token',
+}
+
+# 1x1 png
+QR_IMAGE = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                         '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082')
+
+
+class MockState(object):
+    """
+    模拟服务器的可配置行为与请求记录
+    """
+
+    def __init__(self, latency_ms=0, skew_ms=0, script=None):
+        self.latency_ms = latency_ms
+        self.skew_ms = skew_ms
+        # 依次返回的提交结果, 用完之后返回 60074 (已抢完)
+        self.script = deque(script if script is not None else [0])
+        # [(path, 服务器时间 ms), ...]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def server_ms(self):
+        return time.time() * 1000.0 + self.skew_ms
+
+    def record(self, path):
+        with self.lock:
+            self.requests.append((path, self.server_ms()))
+
+    def next_submit_result(self):
+        with self.lock:
+            code = self.script.popleft() if self.script else 60074
+        return SUBMIT_RESULTS[code]
+
+    def arrivals(self, path):
+        """
+        某个路径的请求到达时间 (服务器时间 ms)
+        :param path:
+        :return:
+        """
+        with self.lock:
+            return [ms for p, ms in self.requests if p == path]
+
+    def reset(self, script=None):
+        with self.lock:
+            self.requests = []
+            self.script = deque(script if script is not None else [0])
+
+
+class MockJDHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头与响应体分两次写出, 不关闭 Nagle 会与客户端的延迟 ACK 叠加出 40ms 的等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, body, content_type='text/html;charset=UTF-8', status=200):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self._delay()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _delay(self):
+        if self.state.latency_ms:
+            time.sleep(self.state.latency_ms / 2000.0)
+
+    def _jsonp(self, query, data):
+        callback = query.get('callback', ['jQuery1234567'])[0]
+        self._send(f"""{callback}({json.dumps(data, ensure_ascii=False)})""", 'application/javascript;charset=UTF-8')
+
+    def _json(self, data):
+        self._send(json.dumps(data, ensure_ascii=False), 'application/json;charset=UTF-8')
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        path, query = url.path, parse_qs(url.query)
+        if self.headers.get('Content-Length'):
+            self.rfile.read(int(self.headers['Content-Length']))
+        # 处理延迟前后各一半, 使请求与响应方向的时延对称
+        self._delay()
+        self.state.record(path)
+
+        if path.endswith('/queryServerData.html'):
+            self._json({'serverTime': int(self.state.server_ms())})
+        elif path.endswith('/center/list.action') or path.endswith('/seckill.action') or path == '/':
+            self._send('<html><head><title>mock</title></head><body></body></html>')
+        elif path.endswith('/show'):
+            self._send(QR_IMAGE, 'image/png')
+        elif path.endswith('/check'):
+            self._jsonp(query, {'code': 200, 'ticket': 'mock-ticket'})
+        elif path.endswith('/qrCodeTicketValidation'):
+            self._json({'returnCode': 0, 'url': ''})
+        elif path.endswith('/getUserInfoForMiniJd.action'):
+            self._jsonp(query, {'nickName': 'mock', 'userLevel': 1})
+        elif path.endswith('/youshouinfo.action'):
+            self._jsonp(query, {'url': f"""//{self.headers.get('Host')}/reserve"""})
+        elif path.endswith('/itemShowBtn'):
+            self._jsonp(query, {'url': '//divide.jd.com/user_routing?skuId=0&sn=mock&from=pc'})
+        elif path.endswith('/init.action'):
+            self._json(SECKILL_INIT_INFO)
+        elif path.endswith('/submitOrder.action'):
+            self._json(self.state.next_submit_result())
+        elif path.endswith('.html'):
+            self._send('<html><head><title>【mock】飞天茅台 53度 500ml</title></head><body></body></html>')
+        else:
+            self._send('', status=200)
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+    do_HEAD = _dispatch
+
+
+class MockJDServer(ThreadingHTTPServer):
+    """
+    本地模拟京东服务器, 按 config.example.yml 中的接口返回相同格式的 JSON / JSONP
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, state=None):
+        super().__init__((host, port), MockJDHandler)
+        self.state = state or MockState()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"""http://{host}:{port}"""
+
+    @property
+    def netloc(self):
+        host, port = self.server_address[:2]
+        return f"""{host}:{port}"""
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='MockJDServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def point_env_params_at(env_params, base_url):
+    """
+    把配置中所有京东接口替换为模拟服务器地址, 只保留路径
+    :param env_params: 配置
+    :param base_url: 模拟服务器地址
+    :return:
+    """
+    for key, value in env_params.items():
+        if isinstance(value, str) and value.startswith('https://'):
+            env_params[key] = base_url + value[len('https://') + len(urlsplit(value).netloc):]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟京东服务器')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的处理延迟 (ms)')
+    parser.add_argument('--skew', type=float, default=0, help='服务器时间相对本地的偏差 (ms)')
+    parser.add_argument('--script', default='0', help='依次返回的提交结果码, 如 60017,90013,0')
+    args = parser.parse_args()
+    script = [int(code) for code in args.script.split(',') if code]
+    server = MockJDServer(port=args.port, state=MockState(args.latency, args.skew, script))
+    print(f"""模拟京东服务器已启动: {server.base_url}""")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import json
+import timeit
+import argparse
+
+import requests
+
+from maotai.bench.mock_server import SECKILL_INIT_INFO
+from maotai.common.response import parse_response, json_backend
+from maotai.common.util import parse_json
+
+
+def make_response(body):
+    """
+    构造未声明字符集的响应, 与京东接口一致 ( resp.text 需要做字符集检测 )
+    :param body: 响应体 bytes
+    :return: requests.Response
+    """
+    resp = requests.Response()
+    resp._content = body
+    resp.status_code = 200
+    resp.headers['Content-Type'] = 'text/html'
+    return resp
+
+
+def make_init_body(address_count):
+    """
+    生成 SECKILL_INIT 的响应体, 地址越多响应体越大
+    :param address_count: 地址数量
+    :return: bytes
+    """
+    info = dict(SECKILL_INIT_INFO)
+    info['addressList'] = [dict(SECKILL_INIT_INFO['addressList'][0], id=i, addressDetail='北京市朝阳区' * 8)
+                           for i in range(address_count)]
+    return json.dumps(info, ensure_ascii=False).encode('utf-8')
+
+
+def bench(name, body, number):
+    """
+    对比 util.parse_json(resp.text) 与 parse_response(resp)
+    每次都新建响应对象, 避免 requests 缓存 resp.text / 字符集检测结果
+    :return:
+    """
+    old = timeit.timeit(lambda: parse_json(make_response(body).text), number=number) / number * 1e6
+    new = timeit.timeit(lambda: parse_response(make_response(body)), number=number) / number * 1e6
+    print(f"""{name:<24}{len(body):>10}{old:>18.2f}{new:>22.2f}{old / new:>9.1f}x""")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='响应解析微基准测试')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+    print(f"""JSON 后端: {json_backend()}""")
+    print(f"""{'响应':<24}{'字节':>10}{'parse_json(us)':>18}{'parse_response(us)':>22}{'加速':>9}""")
+    bench('SUBMIT_ORDER (JSON)', json.dumps({'errorMessage': '很遗憾没有抢到，再接再厉哦。', 'orderId': 0,
+                                            'resultCode': 60074, 'skuId': 0, 'success': False},
+                                           ensure_ascii=False).encode('utf-8'), args.number)
+    bench('USER_INFO (JSONP)', b'jQuery2381773({"nickName":"mock","plusStatus":"0","userLevel":5})', args.number)
+    bench('SECKILL_INIT (5 地址)', make_init_body(5), args.number)
+    bench('SECKILL_INIT (50 地址)', make_init_body(50), args.number // 10 or 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+from maotai.common.util import percentile
+
+# 启动时导入的入口模块
+ENTRY_MODULE = 'maotai.setup'
+# 预算基线: 入口模块必然导入的最重依赖, 同一台机器上测得的耗时加上余量作为预算
+BASELINE_MODULE = 'requests'
+
+# import time: 自身耗时 | 累计耗时 | 模块名 (缩进表示嵌套)
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def import_times(module=ENTRY_MODULE):
+    """
+    在新的解释器中以 -X importtime 导入模块
+    :param module: 模块名
+    :return: (入口模块的累计耗时 us, {模块名: (自身耗时 us, 累计耗时 us)})
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root, PYTHONDONTWRITEBYTECODE='')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"""import {module}"""],
+                          cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    # 解释器启动 (site 等) 不计入
+    return modules[module][1], modules
+
+
+def run(rounds=7, module=ENTRY_MODULE):
+    """
+    多次测量导入耗时
+    :param rounds: 次数
+    :param module: 模块名
+    :return: (每次的总耗时 ms, 最后一次的 {模块名: (自身耗时 us, 累计耗时 us)})
+    """
+    totals = []
+    modules = {}
+    for _ in range(rounds):
+        total, modules = import_times(module)
+        totals.append(total / 1000.0)
+    return totals, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动导入耗时基准测试 (python -X importtime)')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--module', default=ENTRY_MODULE)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='导入耗时中位数上限 (ms), 超出时返回非 0, 默认为基线中位数加 --margin')
+    parser.add_argument('--baseline', default=BASELINE_MODULE, help='测量预算基线的模块')
+    parser.add_argument('--margin', type=float, default=50.0, help='预算相对基线的余量 (ms)')
+    parser.add_argument('--top', type=int, default=15, help='输出累计耗时最多的模块数')
+    args = parser.parse_args()
+
+    totals, modules = run(args.rounds, args.module)
+    budget = args.budget
+    if budget is None:
+        baseline = percentile(run(args.rounds, args.baseline)[0], 50)
+        budget = baseline + args.margin
+        print(f"""基线 {args.baseline}: 中位数 {baseline:.1f} ms, 余量 {args.margin:.1f} ms""")
+    print(f"""{'模块':<48}{'自身 ms':>10}{'累计 ms':>10}""")
+    heaviest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in heaviest:
+        print(f"""{name:<48}{self_us / 1000.0:>10.2f}{cumulative_us / 1000.0:>10.2f}""")
+    median = percentile(totals, 50)
+    print(f"""导入 {args.module}: 中位数 {median:.1f} ms, 最小 {min(totals):.1f} ms, 预算 {budget:.1f} ms""")
+    for heavy in ('lxml', 'yaml', 'multiprocessing', 'concurrent.futures', 'asyncio', 'httpx'):
+        if heavy in modules:
+            print(f"""警告: 启动时导入了 {heavy}""")
+    if median > budget:
+        print('超出启动耗时预算')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import json
+import time
+import logging
+import argparse
+
+import requests
+from requests.adapters import BaseAdapter
+
+from maotai.bench.mock_server import SECKILL_INIT_INFO, SUBMIT_RESULTS
+from maotai.common.response import decode_json
+from maotai.common.config import get_settings
+from maotai.common.governor import RequestGovernor
+from maotai.common.seckill import Seckill, SessionUtil
+from maotai.logger.logutil import logger
+
+
+class CannedAdapter(BaseAdapter):
+    """
+    不发起网络请求, 直接返回固定的提交结果, 只测量客户端的 CPU 开销
+    """
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def send(self, request, **kwargs):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = self.body
+        resp.request = request
+        resp.url = request.url
+        return resp
+
+    def close(self):
+        pass
+
+
+def make_seckill():
+    """
+    构造已完成预热的 Seckill (不检查登录), 所有请求都交给 CannedAdapter
+    请求不经过 RATE_LIMITS 限速, 只测量客户端开销
+    :return:
+    """
+    session_util = SessionUtil()
+    session_util.session.governor = RequestGovernor(limits={})
+    session_util.session.cookies.set('thor', 'x' * 64, domain='.jd.com')
+    body = json.dumps(SUBMIT_RESULTS[60074]).encode('utf-8')
+    session_util.session.mount('https://', CannedAdapter(body))
+    session_util.session.mount('http://', CannedAdapter(body))
+    seckill = Seckill.__new__(Seckill)
+    seckill._init_state(session_util, None, get_settings().sku_id, 2)
+    seckill._apply_seckill_init_info(dict(SECKILL_INIT_INFO))
+    return seckill
+
+
+def legacy_submit(seckill):
+    """
+    改造前的提交方式: 每次重新生成订单参数, 通过 session.post 编码表单并合并 headers
+    :param seckill:
+    :return:
+    """
+    payload, headers = seckill._submit_order_request()
+    data = seckill._get_seckill_order_data(seckill.seckill_init_info[seckill.sku_id])
+    resp = seckill.session.post(url=seckill.settings.submit_order, params=payload, data=data, headers=headers)
+    return decode_json(resp.content)
+
+
+def template_submit(seckill):
+    """
+    预生成请求模板的提交方式, 与 Seckill.submit_seckill_order 一致
+    :param seckill:
+    :return:
+    """
+    return decode_json(seckill._send_submit_order().content)
+
+
+def measure(func, seckill, number):
+    """
+    每次提交的 CPU 耗时 (us)
+    :return:
+    """
+    func(seckill)
+    begin = time.process_time()
+    for _ in range(number):
+        func(seckill)
+    return (time.process_time() - begin) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提交订单的客户端 CPU 开销对比')
+    parser.add_argument('--number', type=int, default=5000)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+    seckill = make_seckill()
+    legacy = measure(legacy_submit, seckill, args.number)
+    template = measure(template_submit, seckill, args.number)
+    print(f"""每次提交 CPU 耗时: 改造前 {legacy:.1f} us, 请求模板 {template:.1f} us, 加速 {legacy / template:.1f}x""")
+
+
+if __name__ == '__main__':
+    main()
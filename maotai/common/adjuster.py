@@ -1,39 +1,53 @@
-import json
 import time
 from datetime import datetime
 
-import requests
-
-from maotai.common.config import env_params
+from maotai.common.clock import ClockSynchronizer
+from maotai.common.config import get_settings
 from maotai.logger.logutil import logger
 
 
 class Adjuster(object):
-    def __init__(self, sleep_interval=0.5):
+    def __init__(self, sleep_interval=0.5, spin_ms=None, clock=None):
+        settings = get_settings()
         # 抢购时间 09:59:59.500
-        buy_time_everyday = env_params.get('BUY_TIME').__str__()
+        buy_time_everyday = settings.buy_time
         localtime = time.localtime(time.time())
         self.buy_time = datetime.strptime(
             f"""{localtime.tm_year.__str__()}-{localtime.tm_mon.__str__()}-{localtime.tm_mday.__str__()} {buy_time_everyday}""",
             "%Y-%m-%d %H:%M:%S.%f")
         self.buy_time_ms = int(time.mktime(self.buy_time.timetuple()) * 1000.0 + self.buy_time.microsecond / 1000)
         self.sleep_interval = sleep_interval
-        self.diff_time = self.local_jd_time_diff()
+        # 距离抢购时间 spin_ms 以内改为忙等, 避免 sleep 唤醒延迟
+        self.spin_ns = int((spin_ms if spin_ms is not None else settings.trigger_spin_ms) * 1e6)
+        self.fire_jitter_us = None
+        # 距离抢购时间 warmup_lead_ms 以内执行预热
+        self.warmup_lead_ns = int(settings.warmup_lead_ms * 1e6)
+        # 外部传入的时钟同步器由调用方启动和停止, 抢购后继续保持同步
+        self.own_clock = clock is None
+        self.clock = clock or ClockSynchronizer()
 
-    @staticmethod
-    def jd_time():
+    @property
+    def offset_ms(self):
+        """
+        京东服务器时间 - 本地时间 (ms)
+        :return:
+        """
+        return self.clock.offset_ms
+
+    @property
+    def uncertainty_ms(self):
+        """
+        时钟偏差的误差上界 (ms)
+        :return:
+        """
+        return self.clock.uncertainty_ms
+
+    def jd_time(self):
         """
-        得到京东服务器的时间戳
+        得到京东服务器的时间戳 (按时钟同步估算的偏差换算)
         :return:
         """
-        url = env_params.get('JD_TIME_API')
-        try:
-            res = requests.get(url, timeout=1)
-            resp = json.load(res.text)
-            return int(resp['serverTime'] + res.elapsed.microseconds / 2)
-        except Exception as e:
-            logger.error(f"""获取京东服务器时间戳失败. Error - {str(e)}.""")
-            raise
+        return int(self.clock.now_jd_ms())
 
     @staticmethod
     def local_time():
@@ -48,13 +62,59 @@ class Adjuster(object):
         计算本地时间戳 与 京东服务器时间戳之间的差值 即时延 ' local - jd '
         :return:
         """
-        return self.local_time() - self.jd_time()
+        return -self.offset_ms
 
-    def start(self):
-        logger.info(f"""等待到达抢购时间: {self.buy_time}, 检测到本地与京东服务器时间差为 - {self.local_jd_time_diff()} ms""")
+    def _wait_coarse(self, warmup=None, quiesce=None, quiesce_lead_ms=0):
+        """
+        粗粒度等待: 按最新的时钟模型重新计算截止时刻, sleep 到截止前 spin_ms 为止
+        距离抢购时间 warmup_lead_ms 以内时执行一次预热, 预热后距离抢购时间 quiesce_lead_ms 以内时执行一次静默
+        :param warmup: 预热函数
+        :param quiesce: 静默函数, 停止抢购前不再需要的后台任务
+        :param quiesce_lead_ms: 距离抢购时间多少毫秒以内执行静默
+        :return: 截止时刻 (单调时钟 ns)
+        """
+        quiesce_lead_ns = int(quiesce_lead_ms * 1e6)
         while True:
-            if self.local_time() - self.local_jd_time_diff() >= self.buy_time_ms:
-                logger.info('抢购时间到达, 开始执行...')
-                break
-            else:
-                time.sleep(self.sleep_interval)
+            deadline_ns = self.clock.monotonic_ns_at(self.buy_time_ms)
+            if warmup is not None and deadline_ns - time.monotonic_ns() <= self.warmup_lead_ns:
+                warmup()
+                warmup = None
+                continue
+            if warmup is None and quiesce is not None and deadline_ns - time.monotonic_ns() <= quiesce_lead_ns:
+                quiesce()
+                quiesce = None
+                continue
+            remaining_ns = deadline_ns - time.monotonic_ns() - self.spin_ns
+            if remaining_ns <= 0:
+                return deadline_ns
+            time.sleep(min(self.sleep_interval, remaining_ns / 1e9))
+
+    @staticmethod
+    def _wait_spin(deadline_ns):
+        """
+        忙等到截止时刻, 不再让出 CPU
+        :param deadline_ns: 截止时刻 (单调时钟 ns)
+        :return: 实际触发时刻 (单调时钟 ns)
+        """
+        now_ns = time.monotonic_ns()
+        while now_ns < deadline_ns:
+            now_ns = time.monotonic_ns()
+        return now_ns
+
+    def start(self, warmup=None, quiesce=None, quiesce_lead_ms=0):
+        """
+        等待到达抢购时间
+        :param warmup: 抢购前需要执行的预热函数
+        :param quiesce: 进入忙等前需要执行的静默函数
+        :param quiesce_lead_ms: 距离抢购时间多少毫秒以内执行静默
+        :return:
+        """
+        self.clock.start()
+        logger.info(f"""等待到达抢购时间: {self.buy_time}, 检测到本地与京东服务器时间差为 - {self.local_jd_time_diff():.2f} ms, """
+                    f"""误差 ± {self.uncertainty_ms:.2f} ms""")
+        deadline_ns = self._wait_coarse(warmup, quiesce, quiesce_lead_ms)
+        fired_ns = self._wait_spin(deadline_ns)
+        if self.own_clock:
+            self.clock.stop()
+        self.fire_jitter_us = (fired_ns - deadline_ns) / 1000
+        logger.info(f"""抢购时间到达, 开始执行... 触发抖动 {self.fire_jitter_us:.1f} us, 时钟误差 ± {self.uncertainty_ms:.2f} ms""")
@@ -0,0 +1,247 @@
+import time
+import asyncio
+import functools
+
+import httpx
+
+from maotai.common.adjuster import Adjuster
+from maotai.common.exception import UnusableResponse
+from maotai.common.governor import governor, THROTTLE_STATUS_CODES
+from maotai.common.response import check_response
+from maotai.common.result import PurchaseResult
+from maotai.common.retry import RetryPolicy, STOP
+from maotai.common.seckill import Seckill
+from maotai.logger.logutil import logger, events
+
+
+class AsyncSeckill(Seckill):
+    """
+    基于 asyncio + httpx 的抢购
+
+    登录 / 预约等非关键路径沿用 Seckill 的同步实现, 抢购时在同一个事件循环中
+    并发执行 concurrency 个提交协程, 共用一个 httpx 连接池, 任意一个成功后取消其余协程
+    """
+
+    def __init__(self, concurrency=None):
+        super().__init__()
+        self.concurrency = concurrency if concurrency is not None else self.settings.async_concurrency
+        self.client = None
+        self._init_lock = None
+        self._keepalive_task = None
+        self._keepalive_stop = None
+
+    def _new_client(self):
+        """
+        创建异步 HTTP 客户端, 复用 SessionUtil 中已登录的 cookies
+        预热在抢购前 WARMUP_LEAD_MS 建立连接, 空闲连接的过期时间需要覆盖整个等待期
+        :return: httpx.AsyncClient
+        """
+        warmup_lead = self.settings.warmup_lead_ms / 1000.0
+        keepalive_expiry = warmup_lead + self.session_util.connection_manager.keepalive_interval
+        limits = httpx.Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency * 2,
+                              keepalive_expiry=keepalive_expiry)
+        return httpx.AsyncClient(headers=self.session_util.get_headers(), cookies=self.session_util.get_cookies(),
+                                 limits=limits, timeout=5)
+
+    async def _request(self, method, url, **kwargs):
+        """
+        与 GovernedSession 一致: 请求前经过 RequestGovernor 限速, 并记录服务端限流
+        :param method: 请求方法
+        :param url: 请求地址
+        :return: httpx.Response
+        """
+        await governor.acquire_async(url)
+        resp = await self.client.request(method, url, **kwargs)
+        if resp.status_code in THROTTLE_STATUS_CODES:
+            governor.server_throttled(url)
+        return resp
+
+    @Seckill.check_login
+    def buy(self):
+        """
+        抢购
+        :return: PurchaseResult
+        """
+        result = asyncio.run(self._buy_async())
+        logger.info(result.summary())
+        return result
+
+    async def _buy_async(self):
+        async with self._new_client() as client:
+            self.client = client
+            self._init_lock = asyncio.Lock()
+            loop = asyncio.get_running_loop()
+
+            def warmup():
+                # Adjuster 在线程池中等待, 预热需要回到事件循环中执行
+                asyncio.run_coroutine_threadsafe(self._warmup_async(), loop).result()
+
+            def quiesce():
+                asyncio.run_coroutine_threadsafe(self._stop_keepalive_async(), loop).result()
+
+            adjuster = Adjuster(clock=self.clock)
+            keeper = self.start_session_keeper(adjuster.buy_time_ms)
+            keepalive_interval = self.session_util.connection_manager.keepalive_interval
+            try:
+                await loop.run_in_executor(None, functools.partial(adjuster.start, warmup=warmup, quiesce=quiesce,
+                                                                   quiesce_lead_ms=keepalive_interval * 1000))
+            finally:
+                if keeper is not None:
+                    keeper.stop()
+                await self._stop_keepalive_async()
+            result = PurchaseResult(buy_time_ms=adjuster.buy_time_ms, triggered_at_ms=time.time() * 1000.0)
+            try:
+                return await self._race(result)
+            finally:
+                self.client = None
+                events.flush()
+
+    async def _warmup_async(self):
+        """
+        预热: 并发建立到抢购相关域名的连接, 提前获取秒杀初始化信息
+        :return:
+        """
+        # 等待期间验证登录时服务端可能下发了新的 cookies
+        self.client.cookies.update(self.session_util.get_cookies())
+        await self._touch_async()
+        self._keepalive_stop = asyncio.Event()
+        self._keepalive_task = asyncio.ensure_future(self._keepalive_async(self._keepalive_stop))
+        try:
+            await self._refresh_seckill_init_info_async()
+            self.seckill_token_fresh = False
+            logger.info('预热完成, 已生成订单基本参数.')
+        except Exception as e:
+            logger.error(f"""预热失败, 抢购时将重新获取初始化信息. Error - {str(e)}""")
+
+    async def _touch_async(self):
+        """
+        对每个域名并发发送 concurrency 个 HEAD 请求, 建立或保活连接池中的连接
+        :return:
+        """
+        connection_manager = self.session_util.connection_manager
+        await asyncio.gather(*[self._request('HEAD', f"""{connection_manager.scheme}://{host}/""")
+                               for host in connection_manager.hosts for _ in range(self.concurrency)],
+                             return_exceptions=True)
+
+    async def _keepalive_async(self, stop_event):
+        """
+        与 ConnectionManager 的保活线程一致: 每隔 keepalive_interval 保活一次连接
+        :param stop_event: 设置后停止
+        :return:
+        """
+        interval = self.session_util.connection_manager.keepalive_interval
+        while True:
+            try:
+                await asyncio.wait_for(stop_event.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                await self._touch_async()
+
+    async def _stop_keepalive_async(self):
+        """
+        停止保活, 等待正在进行的保活请求结束
+        :return:
+        """
+        if self._keepalive_task is None:
+            return
+        self._keepalive_stop.set()
+        await self._keepalive_task
+        self._keepalive_task = None
+
+    async def _race(self, result):
+        """
+        并发提交, 按重试策略停止后不再发起新的提交, 但等待已发出的提交返回 (其中可能有成功的)
+        只有抢购成功后才取消其余协程 (包括尚未返回的请求)
+        :param result: 已记录触发时刻的 PurchaseResult
+        :return: PurchaseResult
+        """
+        policy = RetryPolicy()
+        self.order_id = None
+        stop_event = asyncio.Event()
+        begin = time.perf_counter()
+        tasks = [asyncio.ensure_future(self._attempt_loop(policy, result, stop_event))
+                 for _ in range(self.concurrency)]
+        outcomes = []
+        try:
+            pending = tasks
+            while pending and self.order_id is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                stop_event.set()
+                outcomes.extend(task.result() for task in done)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            result.attempts = len(result.latencies_ms)
+            result.elapsed_ms = (time.perf_counter() - begin) * 1000.0
+        # 优先使用抢购成功的协程给出的停止原因
+        reason = next((reason for success, reason in outcomes if success), outcomes[0][1])
+        return self._finish_purchase(result, reason)
+
+    async def _attempt_loop(self, policy, result, stop_event):
+        """
+        单个提交协程
+        :param policy: 协程之间共用的 RetryPolicy
+        :param result: PurchaseResult, 记录每次提交的耗时
+        :param stop_event: 设置后不再发起新的提交
+        :return: (本协程是否抢购成功, 停止原因)
+        """
+        while not stop_event.is_set():
+            error = None
+            success = False
+            begin = time.perf_counter()
+            try:
+                success = await self.submit_seckill_order_async()
+            except Exception as e:
+                error = e
+                logger.error(f"""抢购失败. Error - {str(e)}""")
+            result.latencies_ms.append((time.perf_counter() - begin) * 1000.0)
+            # 结果码在两次 await 之间读取, 不会被其它协程覆盖
+            decision = self._retry_decision(policy, error)
+            if decision.action == STOP:
+                return success, decision.reason
+            try:
+                await asyncio.wait_for(stop_event.wait(), decision.delay)
+            except asyncio.TimeoutError:
+                pass
+        return False, '其它提交协程已停止抢购'
+
+    async def _refresh_seckill_init_info_async(self):
+        """
+        获取秒杀初始化信息并更新订单参数, 同一时间只有一个协程在获取
+        :return:
+        """
+        async with self._init_lock:
+            if self.seckill_token_fresh:
+                return
+            logger.info('获取秒杀初始化信息...')
+            data, headers = self._seckill_init_request()
+            resp = await self._request('POST', self.settings.seckill_init, data=data, headers=headers)
+            check_response(resp)
+            self._apply_seckill_init_info(self._parse_seckill_init_info(resp.content))
+
+    async def submit_seckill_order_async(self):
+        """
+        提交抢购（秒杀）订单
+        :return: 抢购结果 True/False
+        """
+        self.last_result_code = None
+        if not self.seckill_token_fresh:
+            try:
+                await self._refresh_seckill_init_info_async()
+            except UnusableResponse:
+                self._invalidate_seckill_init_info()
+                raise
+            except Exception as e:
+                self._invalidate_seckill_init_info()
+                logger.info(f"""抢购失败，无法获取生成订单的基本信息，Error -{str(e)}""")
+                return False
+
+        logger.info('提交抢购订单...')
+        events.record('SUBMIT')
+        payload, headers = self._submit_order_request()
+        resp = await self._request('POST', self.settings.submit_order, params=payload,
+                                   data=self.seckill_order_data.get(self.sku_id), headers=headers)
+        events.record('SUBMIT_RESPONSE', resp.status_code)
+        check_response(resp)
+        return self._handle_submit_order_response(resp.content)
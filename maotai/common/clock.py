@@ -0,0 +1,249 @@
+import time
+import threading
+from collections import namedtuple, deque
+
+import requests
+
+from maotai.common.config import get_settings
+from maotai.common.exception import SKException
+from maotai.logger.logutil import logger
+
+# 京东服务器时间为整毫秒截断, 真实时间落在 [serverTime, serverTime + 1) 之间
+SERVER_TIME_RESOLUTION_MS = 1.0
+
+# 一次采样: 本地发送/接收时刻的中点(ms), 京东服务器时间(ms), 往返时延(ms)
+ClockSample = namedtuple('ClockSample', ['local_ms', 'server_ms', 'rtt_ms'])
+
+
+class ClockSync(object):
+    """
+    NTP 方式估算本地时钟与京东服务器时钟的偏差
+
+    连续采样 N 次, 丢弃往返时延偏高的样本, 对剩余样本的置信区间取交集,
+    得到偏差 offset_ms ( jd - local ) 以及误差上界 uncertainty_ms
+    """
+
+    def __init__(self, samples=None, keep=None, timeout=1, session=None):
+        settings = get_settings()
+        self.url = settings.jd_time_api
+        self.samples = samples if samples is not None else settings.clock_sync_samples
+        self.keep = keep if keep is not None else settings.clock_sync_keep
+        self.timeout = timeout
+        self.session = session or requests.session()
+
+        self.offset_ms = 0.0
+        self.uncertainty_ms = None
+        self.rtt_ms = None
+
+    def sample(self):
+        """
+        采集一次京东服务器时间
+        :return: ClockSample
+        """
+        wall_send = time.time()
+        perf_send = time.perf_counter()
+        resp = self.session.get(self.url, timeout=self.timeout)
+        perf_recv = time.perf_counter()
+        server_ms = resp.json()['serverTime']
+        rtt_ms = (perf_recv - perf_send) * 1000.0
+        return ClockSample(local_ms=wall_send * 1000.0 + rtt_ms / 2, server_ms=server_ms, rtt_ms=rtt_ms)
+
+    def collect(self):
+        """
+        连续采样, 失败的采样直接跳过
+        :return: 按往返时延升序排列的样本列表
+        """
+        samples = []
+        for _ in range(self.samples):
+            try:
+                samples.append(self.sample())
+            except Exception as e:
+                logger.error(f"""获取京东服务器时间戳失败. Error - {str(e)}.""")
+        return sorted(samples, key=lambda s: s.rtt_ms)
+
+    @staticmethod
+    def estimate(samples):
+        """
+        根据往返时延最小的若干样本估算时钟偏差
+        每个样本给出的偏差区间为 server - local ± (rtt / 2 + 分辨率 / 2), 各区间取交集;
+        若交集为空 (网络路径不对称), 退回到往返时延最小的样本
+        :param samples: 按往返时延升序排列的样本
+        :return: (offset_ms, uncertainty_ms)
+        """
+        half_res = SERVER_TIME_RESOLUTION_MS / 2
+        low, high = float('-inf'), float('inf')
+        for s in samples:
+            offset = s.server_ms + half_res - s.local_ms
+            half_width = s.rtt_ms / 2 + half_res
+            low = max(low, offset - half_width)
+            high = min(high, offset + half_width)
+        if low > high:
+            best = samples[0]
+            return best.server_ms + half_res - best.local_ms, best.rtt_ms / 2 + half_res
+        return (low + high) / 2, (high - low) / 2
+
+    def sync(self):
+        """
+        执行一次时钟同步
+        :return: self
+        """
+        samples = self.collect()
+        if not samples:
+            raise SKException('无法获取京东服务器时间, 时钟同步失败.')
+        best = samples[:self.keep]
+        self.offset_ms, self.uncertainty_ms = self.estimate(best)
+        self.rtt_ms = best[0].rtt_ms
+        logger.info(f"""时钟同步完成: 有效样本 {len(samples)}/{self.samples}, 最小往返时延 {self.rtt_ms:.2f} ms, """
+                    f"""京东 - 本地 = {self.offset_ms:.2f} ± {self.uncertainty_ms:.2f} ms""")
+        return self
+
+    def now_jd_ms(self):
+        """
+        按当前估算的偏差换算出京东服务器时间
+        :return: 京东服务器时间戳 (ms)
+        """
+        return time.time() * 1000.0 + self.offset_ms
+
+
+class ClockSynchronizer(object):
+    """
+    后台时钟同步器
+
+    按固定间隔执行 ClockSync, 对最近 K 次的偏差做加权线性回归 ( offset + drift * t ),
+    now_jd_ms() 只读取缓存的模型做换算, 不发生任何网络请求.
+    模型以 time.monotonic_ns() 为基准, 不受系统时间调整的影响
+    """
+
+    def __init__(self, interval=None, window=None, clock=None):
+        settings = get_settings()
+        self.clock = clock or ClockSync()
+        self.interval = interval if interval is not None else settings.clock_sync_interval
+        self.window = window if window is not None else settings.clock_sync_window
+        # (单调时钟 ms, 京东 - 单调时钟 ms, 误差 ms)
+        self.points = deque(maxlen=self.window)
+        # (参考单调时钟 ms, 参考时刻的偏差 ms, 漂移率 ms/ms), 整体替换以保证读取线程安全
+        self._model = (0.0, 0.0, 0.0)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def monotonic_ms():
+        """
+        单调时钟 (ms)
+        :return:
+        """
+        return time.monotonic_ns() / 1e6
+
+    @staticmethod
+    def fit(points):
+        """
+        以误差平方的倒数为权重, 拟合 offset = a + b * (mono - ref)
+        :param points: [(mono_ms, offset_ms, uncertainty_ms), ...]
+        :return: (ref_ms, a, b)
+        """
+        ref = points[-1][0]
+        if len(points) < 2:
+            return ref, points[-1][1], 0.0
+        sw = sx = sy = sxx = sxy = 0.0
+        for mono_ms, offset_ms, uncertainty_ms in points:
+            w = 1.0 / max(uncertainty_ms, 0.1) ** 2
+            x = mono_ms - ref
+            sw += w
+            sx += w * x
+            sy += w * offset_ms
+            sxx += w * x * x
+            sxy += w * x * offset_ms
+        denominator = sw * sxx - sx * sx
+        if denominator <= 0:
+            return ref, sy / sw, 0.0
+        drift = (sw * sxy - sx * sy) / denominator
+        return ref, (sy - drift * sx) / sw, drift
+
+    def update(self):
+        """
+        执行一次同步并更新拟合模型
+        :return:
+        """
+        self.clock.sync()
+        # ClockSync 给出的是 京东 - 系统时间, 换算成 京东 - 单调时钟
+        mono_ms = self.monotonic_ms()
+        wall_ms = time.time() * 1000.0
+        self.points.append((mono_ms, self.clock.offset_ms + wall_ms - mono_ms, self.clock.uncertainty_ms))
+        self._model = self.fit(list(self.points))
+        logger.info(f"""时钟模型更新: 偏差 {self.offset_ms:.2f} ms, 漂移 {self.drift_ppm:.2f} ppm""")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"""后台时钟同步失败. Error - {str(e)}""")
+
+    def start(self):
+        """
+        同步一次后启动后台线程
+        :return: self
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.update()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ClockSynchronizer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        停止后台线程
+        :return:
+        """
+        self._stop_event.set()
+
+    def jd_ms_at(self, mono_ms):
+        """
+        按拟合模型把单调时钟换算成京东服务器时间
+        :param mono_ms: 单调时钟 (ms)
+        :return: 京东服务器时间戳 (ms)
+        """
+        ref, offset, drift = self._model
+        return mono_ms + offset + drift * (mono_ms - ref)
+
+    def monotonic_ns_at(self, jd_ms):
+        """
+        按拟合模型计算京东服务器时间对应的单调时钟, 用于精确定时
+        :param jd_ms: 京东服务器时间戳 (ms)
+        :return: 单调时钟 (ns)
+        """
+        ref, offset, drift = self._model
+        return int((jd_ms - offset + drift * ref) / (1 + drift) * 1e6)
+
+    def now_jd_ms(self):
+        """
+        按缓存的模型换算当前京东服务器时间
+        :return: 京东服务器时间戳 (ms)
+        """
+        return self.jd_ms_at(self.monotonic_ms())
+
+    @property
+    def offset_ms(self):
+        """
+        当前时刻的偏差 京东 - 本地 (ms)
+        :return:
+        """
+        return self.now_jd_ms() - time.time() * 1000.0
+
+    @property
+    def drift_ppm(self):
+        """
+        本地时钟相对京东服务器的漂移率 (ppm)
+        :return:
+        """
+        return self._model[2] * 1e6
+
+    @property
+    def uncertainty_ms(self):
+        """
+        最近一次同步的误差上界 (ms)
+        :return:
+        """
+        return self.clock.uncertainty_ms
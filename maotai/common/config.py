@@ -1,25 +1,300 @@
 import os
+import json
 
-import yaml
+from maotai.common.exception import SKException
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config/config.yml")
 
 config_params = {}
 
 
+def _cache_file(file):
+    """
+    配置文件对应的 JSON 缓存文件
+    :param file: config file name
+    :return:
+    """
+    directory, name = os.path.split(file)
+    return os.path.join(directory, f""".{name}.cache""")
+
+
 def init_config_params(file):
     """
     从配置文件初始化系统运行配置参数
+    配置文件的修改时间与大小未变化时直接读取上次解析结果的 JSON 缓存
     :param file: config file name
     :return: config obj
     """
     global config_params
     if config_params:
         return config_params
+    stat = os.stat(file)
+    signature = [stat.st_mtime_ns, stat.st_size]
+    cache_file = _cache_file(file)
     try:
-        with open(file, 'r', encoding='utf-8') as stream:
-            config_params = yaml.load(stream, Loader=yaml.FullLoader)
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['signature'] == signature:
+            config_params = cache['params']
+            return config_params
+    except Exception:
+        pass
+    # 只有缓存失效时才需要导入 yaml, 优先使用 libyaml 实现的 C 解析器
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(file, 'r', encoding='utf-8') as stream:
+        config_params = yaml.load(stream, Loader=loader) or {}
+    try:
+        text = json.dumps({'signature': signature, 'params': config_params}, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return config_params
+    # 日期、非字符串键等无法原样写入 JSON 的配置不缓存
+    if json.loads(text)['params'] != config_params:
         return config_params
-    except Exception as e:
-        raise
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+    except OSError:
+        pass
+    return config_params
+
+
+class LazyConfig(dict):
+    """
+    首次访问时才加载配置文件的 dict
+    """
+
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            super().update(init_config_params(self.file))
+        return self
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self.load(), key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self.load(), key, value)
+
+    def __contains__(self, key):
+        return dict.__contains__(self.load(), key)
+
+    def __iter__(self):
+        return dict.__iter__(self.load())
+
+    def __len__(self):
+        return dict.__len__(self.load())
+
+    def get(self, key, default=None):
+        return dict.get(self.load(), key, default)
+
+    def keys(self):
+        return dict.keys(self.load())
+
+    def values(self):
+        return dict.values(self.load())
+
+    def items(self):
+        return dict.items(self.load())
+
+
+env_params = LazyConfig(CONFIG_FILE)
+
+
+def normalize_buy_time(value):
+    """
+    统一抢购时间格式为 HH:MM:SS.fff
+    YAML 1.1 会把未加引号的 09:59:59.500 解析为 60 进制数 35999.5, 这里转换回来
+    :param value: 配置中的 BUY_TIME
+    :return:
+    """
+    if isinstance(value, (int, float)):
+        millis = int(round(value * 1000))
+        seconds, millis = divmod(millis, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"""{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}"""
+    value = str(value)
+    return value if '.' in value else value + '.000'
+
+
+class SkuSettings(object):
+    """
+    针对某个商品预先格式化好的地址与 Referer, 抢购路径上不再查询配置或格式化字符串
+    """
+    __slots__ = ('sku_id', 'num', 'product_info_url', 'yushow_refer', 'get_seckill_link_refer',
+                 'request_seckill_refer', 'request_seckill_checkout_refer',
+                 'submit_order_refer_prefix', 'submit_order_refer_suffix')
+
+    def __init__(self, settings, sku_id, num):
+        values = {
+            'sku_id': sku_id,
+            'num': num,
+            'product_info_url': settings.product_info.format(sku_id),
+            'yushow_refer': settings.yushow_refer.format(sku_id),
+            'get_seckill_link_refer': settings.get_seckill_link_refer.format(sku_id),
+            'request_seckill_refer': settings.request_seckill_refer.format(sku_id),
+            'request_seckill_checkout_refer': settings.request_seckill_checkout_refer.format(sku_id),
+        }
+        # SUBMIT_ORDER_REFER 中只有 rid 每次变化, 拆成前后两段
+        prefix, _, suffix = settings.submit_order_refer.format(sku_id, num, '\0').partition('\0')
+        values['submit_order_refer_prefix'] = prefix
+        values['submit_order_refer_suffix'] = suffix
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"""{type(self).__name__} 不可修改""")
+
+    def submit_order_refer(self, rid):
+        """
+        提交订单的 Referer
+        :param rid: 时间戳 (秒)
+        :return:
+        """
+        return self.submit_order_refer_prefix + str(rid) + self.submit_order_refer_suffix
+
+
+def non_negative(convert):
+    """
+    转换后要求 >= 0 的配置项, 0 是有效值 (如 COOKIE_TRUST_SECONDS: 0 表示每次都联网验证)
+    :param convert: 类型转换函数
+    :return:
+    """
+    def check(value):
+        value = convert(value)
+        if value < 0:
+            raise ValueError('不能为负数')
+        return value
+    return check
+
+
+def positive(convert):
+    """
+    转换后要求 > 0 的配置项 (数量 / 速率 / 间隔)
+    :param convert: 类型转换函数
+    :return:
+    """
+    def check(value):
+        value = convert(value)
+        if value <= 0:
+            raise ValueError('必须大于 0')
+        return value
+    return check
+
+
+REQUIRED = object()
 
 
-env_params = init_config_params(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config/config.yml"))
+class Settings(object):
+    """
+    校验后的只读配置
+    """
+    # (属性名, 配置项, 类型, 默认值), 可选项未配置时保持默认值不做类型转换
+    FIELDS = (
+        ('sku_id', 'SKU_ID', str, REQUIRED),
+        ('buy_time', 'BUY_TIME', normalize_buy_time, REQUIRED),
+        ('order_time', 'ORDER_TIME', normalize_buy_time, None),
+        ('eid', 'EID', str, None),
+        ('fp', 'FP', str, None),
+        ('payment_pwd', 'PAYMENT_PWD', str, None),
+        ('jd_time_api', 'JD_TIME_API', str, REQUIRED),
+        ('product_info', 'PRODUCT_INFO', str, REQUIRED),
+        ('yushow_refer', 'YUSHOW_REFER', str, REQUIRED),
+        ('get_seckill_link_refer', 'GET_SECKILL_LINK_REFER', str, REQUIRED),
+        ('request_seckill_refer', 'REQUEST_SECKILL_REFER', str, REQUIRED),
+        ('request_seckill_checkout_refer', 'REQUEST_SECKILL_CHECKOUT_REFER', str, REQUIRED),
+        ('seckill_init', 'SECKILL_INIT', str, REQUIRED),
+        ('submit_order', 'SUBMIT_ORDER', str, REQUIRED),
+        ('submit_order_refer', 'SUBMIT_ORDER_REFER', str, REQUIRED),
+        # 数值项: 显式配置为 0 时保留 0, 只有未配置时才使用默认值
+        ('trigger_spin_ms', 'TRIGGER_SPIN_MS', non_negative(float), 5),
+        ('warmup_lead_ms', 'WARMUP_LEAD_MS', non_negative(float), 30000),
+        ('clock_sync_samples', 'CLOCK_SYNC_SAMPLES', positive(int), 8),
+        ('clock_sync_keep', 'CLOCK_SYNC_KEEP', positive(int), 3),
+        ('clock_sync_interval', 'CLOCK_SYNC_INTERVAL', positive(float), 30),
+        ('clock_sync_window', 'CLOCK_SYNC_WINDOW', positive(int), 10),
+        ('connection_pool_size', 'CONNECTION_POOL_SIZE', positive(int), 4),
+        ('keepalive_interval', 'KEEPALIVE_INTERVAL', positive(float), 15),
+        ('cookie_trust_seconds', 'COOKIE_TRUST_SECONDS', non_negative(float), 1800),
+        ('metadata_cache_ttl', 'METADATA_CACHE_TTL', non_negative(float), 86400),
+        ('session_keeper_interval', 'SESSION_KEEPER_INTERVAL', positive(float), 300),
+        ('session_alert_seconds', 'SESSION_ALERT_SECONDS', non_negative(float), 600),
+        ('session_keeper_quiet_seconds', 'SESSION_KEEPER_QUIET_SECONDS', non_negative(float), 60),
+        ('qr_poll_min_interval', 'QR_POLL_MIN_INTERVAL', positive(float), 0.5),
+        ('qr_poll_max_interval', 'QR_POLL_MAX_INTERVAL', positive(float), 4),
+        ('qr_login_timeout', 'QR_LOGIN_TIMEOUT', positive(float), 340),
+        ('retry_deadline', 'RETRY_DEADLINE', non_negative(float), None),
+        ('retry_max_attempts', 'RETRY_MAX_ATTEMPTS', non_negative(int), None),
+        ('retry_backoff_base_ms', 'RETRY_BACKOFF_BASE_MS', non_negative(float), 200),
+        ('retry_backoff_max_ms', 'RETRY_BACKOFF_MAX_MS', non_negative(float), 2000),
+        ('prefetch_queue_size', 'PREFETCH_QUEUE_SIZE', positive(int), 2),
+        ('prefetch_token_ttl_ms', 'PREFETCH_TOKEN_TTL_MS', positive(float), 3000),
+        ('prefetch_rate', 'PREFETCH_RATE', positive(float), 5),
+        ('async_concurrency', 'ASYNC_CONCURRENCY', positive(int), 4),
+        ('multi_process_workers', 'MULTI_PROCESS_WORKERS', positive(int), 5),
+        ('multi_process_timeout', 'MULTI_PROCESS_TIMEOUT', positive(float), 60),
+        ('daemon_prepare_seconds', 'DAEMON_PREPARE_SECONDS', non_negative(float), 600),
+        ('daemon_order_deadline', 'DAEMON_ORDER_DEADLINE', non_negative(float), 300),
+        ('daemon_clock_sync_interval', 'DAEMON_CLOCK_SYNC_INTERVAL', positive(float), 300),
+    )
+    __slots__ = tuple(field[0] for field in FIELDS) + ('_sku_settings',)
+
+    def __init__(self, params):
+        for name, key, convert, default in self.FIELDS:
+            value = params.get(key)
+            if value is None:
+                if default is REQUIRED:
+                    raise SKException(f"""配置项 {key} 不能为空.""")
+                object.__setattr__(self, name, default)
+            else:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError) as e:
+                    raise SKException(f"""配置项 {key} 无效: {value!r}, {str(e)}""")
+                object.__setattr__(self, name, value)
+        object.__setattr__(self, '_sku_settings', {})
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"""{type(self).__name__} 不可修改""")
+
+    def for_sku(self, sku_id, num):
+        """
+        商品对应的预格式化配置, 每个 (sku_id, num) 只生成一次
+        :param sku_id: 商品 id
+        :param num: 数量
+        :return: SkuSettings
+        """
+        key = (sku_id, num)
+        sku_settings = self._sku_settings.get(key)
+        if sku_settings is None:
+            sku_settings = self._sku_settings[key] = SkuSettings(self, sku_id, num)
+        return sku_settings
+
+
+_settings = None
+
+
+def get_settings():
+    """
+    获得校验后的只读配置 (只生成一次)
+    :return: Settings
+    """
+    global _settings
+    if _settings is None:
+        _settings = Settings(env_params)
+    return _settings
+
+
+def reset_settings():
+    """
+    env_params 被修改后重新生成 Settings
+    :return:
+    """
+    global _settings
+    _settings = None
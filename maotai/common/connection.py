@@ -0,0 +1,250 @@
+import time
+import threading
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from maotai.common.config import env_params, get_settings
+from maotai.common.trace import current_record
+from maotai.logger.logutil import logger
+
+DEFAULT_PREWARM_HOSTS = ['marathon.jd.com', 'itemko.jd.com']
+
+
+class CountingPoolMixin(object):
+    """
+    统计连接池中的连接是复用的还是新建的
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def _get_conn(self, timeout=None):
+        record = current_record()
+        begin_ns = time.monotonic_ns()
+        conn = super()._get_conn(timeout)
+        # sock 为空说明本次请求需要重新建立 TCP/TLS 连接
+        if conn.sock is None:
+            self.new_connections += 1
+            if record is not None:
+                record['new_connection'] = True
+                self._trace_connect(conn, record)
+        else:
+            self.reused_connections += 1
+        if record is not None:
+            record['queue_ns'] += time.monotonic_ns() - begin_ns
+        return conn
+
+    @staticmethod
+    def _trace_connect(conn, record):
+        """
+        记录本次请求建立连接的耗时
+        :param conn: 连接
+        :param record: 请求记录
+        :return:
+        """
+        connect = conn.connect
+
+        def traced_connect(*args, **kwargs):
+            begin_ns = time.monotonic_ns()
+            try:
+                return connect(*args, **kwargs)
+            finally:
+                record['connect_ns'] += time.monotonic_ns() - begin_ns
+                del conn.connect
+
+        conn.connect = traced_connect
+
+    def touch(self, count, headers=None, stop_event=None):
+        """
+        逐个取出 count 个连接, 未连接的完成 DNS/TCP/TLS 握手, 已连接的发送一次 HEAD 请求保活
+        每次只占用一个连接, 处理完放回队列底部, 抢购请求随时能取到空闲连接
+        不计入连接统计
+        :param count: 连接数
+        :param headers: 保活请求的 headers
+        :param stop_event: 设置后不再取出连接
+        :return: 新建立的连接数
+        """
+        opened = 0
+        for _ in range(count):
+            if stop_event is not None and stop_event.is_set():
+                break
+            conn = super(CountingPoolMixin, self)._get_conn()
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    opened += 1
+                else:
+                    conn.request('HEAD', '/', headers=headers or {})
+                    conn.getresponse().read()
+            except Exception as e:
+                conn.close()
+                logger.error(f"""预热连接 {self.host} 失败. Error - {str(e)}""")
+            finally:
+                self._put_conn_last(conn)
+        return opened
+
+    def _put_conn_last(self, conn):
+        """
+        把连接放回队列底部 (连接池按后进先出取用), 下一次 touch 取到的是尚未处理的连接
+        :param conn: 连接
+        :return:
+        """
+        queue = self.pool
+        if queue is None:
+            conn.close()
+            return
+        with queue.mutex:
+            queue.queue.insert(0, conn)
+            queue.not_empty.notify()
+
+
+class CountingHTTPConnectionPool(CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    使用可统计连接复用情况的连接池, 开启追踪时记录收到响应头的时刻
+    """
+
+    def send(self, request, *args, **kwargs):
+        record = current_record()
+        if record is None:
+            return super().send(request, *args, **kwargs)
+        record['adapter_ns'] = time.monotonic_ns()
+        response = super().send(request, *args, **kwargs)
+        record['headers_ns'] = time.monotonic_ns()
+        return response
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+class ConnectionManager(object):
+    """
+    连接管理: 抢购前预先建立到抢购相关域名的 keep-alive 连接并定时保活,
+    抢购时请求直接复用已握手的连接
+    """
+
+    def __init__(self, session, hosts=None, pool_size=None, keepalive_interval=None, scheme='https'):
+        settings = get_settings()
+        self.session = session
+        self.scheme = scheme
+        self.hosts = hosts or env_params.get('PREWARM_HOSTS') or DEFAULT_PREWARM_HOSTS
+        self.pool_size = pool_size if pool_size is not None else settings.connection_pool_size
+        self.keepalive_interval = keepalive_interval if keepalive_interval is not None else settings.keepalive_interval
+        self.adapter = PooledAdapter(pool_connections=len(self.hosts) + 8, pool_maxsize=self.pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _url(self, host):
+        """
+        域名对应的根路径
+        :param host: 域名, 可带端口
+        :return:
+        """
+        return f"""{self.scheme}://{host}/"""
+
+    def _pool(self, host):
+        """
+        查找域名对应的连接池
+        :param host: 域名, 可带端口
+        :return: 连接池, 尚未创建时返回 None
+        """
+        url = urlsplit(self._url(host))
+        port = url.port or (443 if self.scheme == 'https' else 80)
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None and pool.host == url.hostname and pool.port == port:
+                return pool
+        return None
+
+    def prewarm(self):
+        """
+        对每个域名建立 pool_size 个连接
+        :return:
+        """
+        for host in self.hosts:
+            try:
+                if self._pool(host) is None:
+                    # 第一次请求会创建连接池并完成 DNS 解析
+                    self.session.head(self._url(host), allow_redirects=False, timeout=3)
+                opened = self._pool(host).touch(self.pool_size, headers=self._keepalive_headers())
+                logger.info(f"""预热连接 {host} 完成, 新建连接 {opened} 个""")
+            except Exception as e:
+                logger.error(f"""预热连接 {host} 失败. Error - {str(e)}""")
+
+    def _keepalive_headers(self):
+        """
+        保活请求的 headers
+        :return:
+        """
+        return {
+            'User-Agent': self.session.headers.get('User-Agent'),
+            'Connection': 'keep-alive',
+        }
+
+    def _run(self):
+        while not self._stop_event.wait(self.keepalive_interval):
+            for host in self.hosts:
+                pool = self._pool(host)
+                if pool is None:
+                    continue
+                pool.touch(self.pool_size, headers=self._keepalive_headers(), stop_event=self._stop_event)
+
+    def start_keepalive(self):
+        """
+        启动后台保活线程
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ConnectionKeepAlive', daemon=True)
+        self._thread.start()
+
+    def stop_keepalive(self):
+        """
+        停止后台保活线程, 等待正在进行的保活请求结束
+        :return:
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        """
+        各域名的连接复用统计
+        :return: {host: {'new': 新建连接数, 'reused': 复用连接数}}
+        """
+        result = {}
+        for host in self.hosts:
+            pool = self._pool(host)
+            if pool is not None:
+                result[host] = {'new': pool.new_connections, 'reused': pool.reused_connections}
+        return result
+
+    def log_stats(self):
+        """
+        输出连接复用统计
+        :return:
+        """
+        for host, stat in self.stats().items():
+            logger.info(f"""连接统计 {host}: 复用 {stat['reused']}, 新建 {stat['new']}""")
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import time
+from collections import namedtuple
+
+from requests.cookies import RequestsCookieJar, create_cookie
+
+from maotai.common.config import get_settings
+from maotai.common.util import write_atomic
+from maotai.logger.logutil import logger
+
+COOKIE_SUFFIX = '.cookies.json'
+# 账号信息缓存 (MetadataCache) 文件, 与 cookies 文件放在一起
+METADATA_SUFFIX = '.meta.json'
+# 记录最近一次保存的账号, 未指定账号时据此直接定位 cookies 文件
+CURRENT_ACCOUNT_FILE = '.current'
+# 登录态相关的 cookie, 其中最早的过期时间作为整个 cookies 的过期时间
+LOGIN_COOKIES = ('thor', 'pin', 'pinId', 'pt_key')
+
+# 账号, RequestsCookieJar, 保存时间, 上次验证有效的时间, 过期时间 (均为时间戳 秒, 过期时间未知时为 None)
+CookieRecord = namedtuple('CookieRecord', ['account', 'cookies', 'saved_at', 'verified_at', 'expires_at'])
+
+
+class CookieStore(object):
+    """
+    按账号保存 cookies 的 JSON 文件, 附带验证时间与过期时间
+    写入临时文件后替换, 中断时不会留下不完整的文件
+    """
+
+    def __init__(self, folder, trust_seconds=None):
+        """
+        :param folder: 保存目录
+        :param trust_seconds: 验证有效后多长时间内(秒)不再联网验证, 默认读取配置 COOKIE_TRUST_SECONDS
+        """
+        self.folder = folder
+        self.trust_seconds = trust_seconds if trust_seconds is not None else get_settings().cookie_trust_seconds
+
+    @staticmethod
+    def _file_name(account):
+        """
+        账号对应的文件名, 去掉文件名中不允许的字符
+        :param account: 账号
+        :return:
+        """
+        return re.sub(r'[\\/:*?"<>|]', '_', account)
+
+    def path(self, account, suffix=COOKIE_SUFFIX):
+        """
+        账号对应的文件, 默认为 cookies 文件
+        :param account: 账号
+        :param suffix: 文件后缀, 如 METADATA_SUFFIX
+        :return:
+        """
+        return os.path.join(self.folder, self._file_name(account) + suffix)
+
+    def current_account(self):
+        """
+        最近一次保存的账号
+        :return: 没有时为 None
+        """
+        try:
+            with open(os.path.join(self.folder, CURRENT_ACCOUNT_FILE), 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def load(self, account):
+        """
+        读取账号的 cookies
+        :param account: 账号
+        :return: CookieRecord, 文件不存在或损坏时为 None
+        """
+        try:
+            with open(self.path(account), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            jar = RequestsCookieJar()
+            for name, value, domain, path, expires, secure, rest in data['cookies']:
+                jar.set_cookie(create_cookie(name, value, domain=domain, path=path, expires=expires,
+                                             secure=secure, rest=rest))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"""读取 cookies 文件 {self.path(account)} 失败. Error - {str(e)}""")
+            return None
+        return CookieRecord(account, jar, data.get('saved_at'), data.get('verified_at'), data.get('expires_at'))
+
+    def save(self, account, cookies):
+        """
+        保存账号的 cookies, 调用方需已确认 cookies 有效
+        :param account: 账号
+        :param cookies: RequestsCookieJar
+        :return: CookieRecord
+        """
+        now = time.time()
+        items = []
+        expires_at = None
+        for cookie in cookies:
+            items.append([cookie.name, cookie.value, cookie.domain, cookie.path, cookie.expires, cookie.secure,
+                          dict(cookie._rest)])
+            if cookie.name in LOGIN_COOKIES and cookie.expires:
+                expires_at = cookie.expires if expires_at is None else min(expires_at, cookie.expires)
+        data = {'account': account, 'saved_at': now, 'verified_at': now, 'expires_at': expires_at, 'cookies': items}
+        write_atomic(self.path(account), json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        write_atomic(os.path.join(self.folder, CURRENT_ACCOUNT_FILE), account)
+        return CookieRecord(account, cookies, now, now, expires_at)
+
+    def is_fresh(self, record):
+        """
+        cookies 是否可以不经联网验证直接使用: 验证有效后未超过信任时间, 且登录态 cookie 未过期
+        :param record: CookieRecord
+        :return:
+        """
+        now = time.time()
+        if record is None or not record.verified_at or now - record.verified_at > self.trust_seconds:
+            return False
+        return record.expires_at is None or now < record.expires_at
@@ -3,3 +3,14 @@ class SKException(Exception):
 
     def __init__(self, message):
         super().__init__(message)
+
+
+class UnusableResponse(SKException):
+    """
+    响应在解析前即被判定为不可用 (登录页 / 限流页 / 错误页)
+    action 为下一步动作: 重新登录 或 退避后重试
+    """
+
+    def __init__(self, action, message):
+        super().__init__(message)
+        self.action = action
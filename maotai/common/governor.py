@@ -0,0 +1,184 @@
+import time
+import threading
+from urllib.parse import urlsplit
+
+from maotai.common.config import env_params
+from maotai.common.trace import TracingSession
+from maotai.logger.logutil import logger
+
+# 服务端限流的响应状态码
+THROTTLE_STATUS_CODES = (429, 503)
+# 多进程分摊限额时每个进程至少保留的突发请求数: 抢购触发时需要连续发出初始化与提交两个请求
+MIN_SHARED_BURST = 2
+
+
+class TokenBucket(object):
+    """
+    令牌桶: 每秒补充 rate 个令牌, 最多积攒 burst 个
+    令牌不足时预约未来的令牌, 调用方在锁外等待, 多线程按先后顺序放行
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        取出一个令牌
+        :return: 需要等待的时间(秒)
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RequestGovernor(object):
+    """
+    按域名限制请求速率, 并统计被本地限流 / 被服务端限流的请求数
+    """
+
+    def __init__(self, limits=None):
+        """
+        :param limits: {域名: {'rate': 每秒请求数, 'burst': 突发请求数}}, 默认读取配置 RATE_LIMITS
+        """
+        self._limits = limits
+        self._buckets = None
+        # 多个进程分摊同一份限额时, 每个进程只使用其中的 share
+        self.share = 1.0
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, host):
+        """
+        域名对应的令牌桶
+        :param host: 域名
+        :return: 未配置限速时为 None
+        """
+        if self._buckets is None:
+            with self.lock:
+                if self._buckets is None:
+                    limits = self._limits if self._limits is not None else env_params.get('RATE_LIMITS') or {}
+                    self._buckets = {name: TokenBucket(limit['rate'] * self.share, self._shared_burst(limit))
+                                     for name, limit in limits.items()}
+        return self._buckets.get(host)
+
+    def _shared_burst(self, limit):
+        """
+        本进程的突发请求数: 只平分持续速率, 突发请求数不低于 MIN_SHARED_BURST (配置更小时以配置为准),
+        避免抢购触发时的第一次提交在本地等待
+        :param limit: {'rate': 每秒请求数, 'burst': 突发请求数}
+        :return:
+        """
+        burst = limit.get('burst') or limit['rate']
+        return max(1.0, min(MIN_SHARED_BURST, burst), burst * self.share)
+
+    def set_share(self, share):
+        """
+        设置本进程分摊的限额比例, 多进程抢购时每个进程为 1 / 进程数, 使总的持续速率不超过 RATE_LIMITS
+        :param share: 比例 (0, 1]
+        :return:
+        """
+        with self.lock:
+            self.share = share
+            self._buckets = None
+
+    def _count(self, host, **increments):
+        """
+        累加域名的统计
+        :param host: 域名
+        :param increments: 统计项及增量
+        :return:
+        """
+        with self.lock:
+            stat = self.stats.get(host)
+            if stat is None:
+                stat = self.stats[host] = {'requests': 0, 'client_throttled': 0, 'server_throttled': 0, 'wait_ms': 0.0}
+            for key, value in increments.items():
+                stat[key] += value
+
+    def _reserve(self, url):
+        """
+        取出一个令牌并记录统计
+        :param url: 请求地址
+        :return: 需要等待的时间(秒)
+        """
+        host = urlsplit(url).hostname
+        bucket = self._bucket(host)
+        delay = bucket.reserve() if bucket is not None else 0.0
+        if delay > 0:
+            self._count(host, requests=1, client_throttled=1, wait_ms=delay * 1000.0)
+        else:
+            self._count(host, requests=1)
+        return delay
+
+    def acquire(self, url):
+        """
+        发送请求前取得令牌, 超过速率时等待
+        :param url: 请求地址
+        :return: 等待时间(秒)
+        """
+        delay = self._reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, url):
+        """
+        acquire 的协程版本, 等待时不阻塞事件循环
+        :param url: 请求地址
+        :return: 等待时间(秒)
+        """
+        import asyncio
+
+        delay = self._reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def server_throttled(self, url):
+        """
+        记录一次服务端限流 (HTTP 429/503 或提交过快的结果码)
+        :param url: 请求地址
+        :return:
+        """
+        self._count(urlsplit(url).hostname, server_throttled=1)
+
+    def log_stats(self):
+        """
+        输出各域名的请求与限流统计
+        :return:
+        """
+        with self.lock:
+            stats = {host: dict(stat) for host, stat in self.stats.items()}
+        for host, stat in stats.items():
+            logger.info(f"""请求统计 {host}: 请求 {stat['requests']}, 本地限流 {stat['client_throttled']} """
+                        f"""(等待 {stat['wait_ms']:.0f} ms), 服务端限流 {stat['server_throttled']}""")
+
+
+governor = RequestGovernor()
+
+
+class GovernedSession(TracingSession):
+    """
+    所有请求经过 RequestGovernor 限速
+    """
+
+    def __init__(self, request_governor=None):
+        """
+        :param request_governor: RequestGovernor, 默认为进程内共用的 governor
+        """
+        super().__init__()
+        self.governor = request_governor or governor
+
+    def send(self, request, **kwargs):
+        self.governor.acquire(request.url)
+        response = super().send(request, **kwargs)
+        if response.status_code in THROTTLE_STATUS_CODES:
+            self.governor.server_throttled(request.url)
+        return response
@@ -0,0 +1,82 @@
+import json
+import time
+
+from maotai.common.config import get_settings
+from maotai.common.util import write_atomic
+from maotai.logger.logutil import logger
+
+
+class MetadataCache(object):
+    """
+    账号相关信息 (用户名 / 商品名称等) 的本地缓存, 每个账号一个文件, 保存在 cookies 文件旁
+    每一项有独立的过期时间
+    """
+
+    def __init__(self, path, ttl=None):
+        """
+        :param path: 缓存文件
+        :param ttl: 有效期(秒), 默认读取配置 METADATA_CACHE_TTL
+        """
+        self.path = path
+        self.ttl = ttl if ttl is not None else get_settings().metadata_cache_ttl
+        self.entries = self._load()
+
+    def _load(self):
+        """
+        读取缓存文件, 文件不存在或损坏时为空
+        :return:
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"""读取缓存文件 {self.path} 失败. Error - {str(e)}""")
+            return {}
+
+    def _save(self):
+        """
+        原子写入缓存文件, 避免中断时留下不完整的缓存文件
+        :return:
+        """
+        try:
+            write_atomic(self.path, json.dumps(self.entries, ensure_ascii=False))
+        except OSError as e:
+            logger.error(f"""写入缓存文件 {self.path} 失败. Error - {str(e)}""")
+
+    def get(self, key):
+        """
+        读取未过期的缓存项
+        :param key: 缓存项
+        :return: 不存在或已过期时为 None
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry.get('expires_at', 0) <= time.time():
+            return None
+        return entry.get('value')
+
+    def set(self, key, value):
+        """
+        写入缓存项并保存
+        :param key: 缓存项
+        :param value: 可序列化为 JSON 的值
+        :return:
+        """
+        self.entries[key] = {'value': value, 'expires_at': time.time() + self.ttl}
+        self._save()
+
+    def get_or_load(self, key, loader):
+        """
+        读取缓存项, 不存在或已过期时调用 loader 获取并写入缓存
+        :param key: 缓存项
+        :param loader: 获取最新值的函数
+        :return:
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value:
+                self.set(key, value)
+        return value
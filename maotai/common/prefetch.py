@@ -0,0 +1,147 @@
+import time
+import threading
+from collections import deque
+
+from maotai.common.config import get_settings
+from maotai.common.exception import UnusableResponse
+from maotai.common.retry import RetryPolicy, REAUTH
+from maotai.logger.logutil import logger
+
+
+class TokenPrefetcher(object):
+    """
+    流水线预取: 后台线程按限定速率获取秒杀初始化信息, 放入有界队列,
+    提交时直接取用, 第 N 次提交与第 N+1 次的初始化请求同时进行
+    队列中的初始化信息超过有效期后丢弃, 队列满时暂停获取
+    返回登录页时停止获取, 返回限流页 / 错误页时退避, 二者都通过 take() 交给调用方的重试策略
+    """
+
+    def __init__(self, seckill, size=None, ttl_ms=None, rate=None):
+        """
+        :param seckill: Seckill, 使用其会话获取初始化信息
+        :param size: 队列长度
+        :param ttl_ms: 初始化信息的有效期(ms)
+        :param rate: 每秒最多获取次数
+        """
+        settings = get_settings()
+        self.seckill = seckill
+        self.size = size if size is not None else settings.prefetch_queue_size
+        self.ttl = (ttl_ms if ttl_ms is not None else settings.prefetch_token_ttl_ms) / 1000.0
+        self.interval = 1.0 / (rate if rate is not None else settings.prefetch_rate)
+        self.fetched = 0
+        self.expired = 0
+        self.failed = 0
+
+        self._tokens = deque()
+        # 最近一次被判定为不可用的响应 (UnusableResponse), 队列取空后由 take() 抛出
+        self._error = None
+        self._policy = RetryPolicy(deadline=0)
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _purge(self):
+        """
+        丢弃队首已过期的初始化信息, 调用方需持有锁
+        :return:
+        """
+        now = time.monotonic()
+        while self._tokens and self._tokens[0][0] <= now:
+            self._tokens.popleft()
+            self.expired += 1
+
+    def _wait_for_space(self):
+        """
+        等待队列有空位
+        :return: 已停止时返回 False
+        """
+        with self._cond:
+            self._purge()
+            while len(self._tokens) >= self.size and not self._stop_event.is_set():
+                # 队首过期后即可腾出空位
+                self._cond.wait(max(self._tokens[0][0] - time.monotonic(), 0.001))
+                self._purge()
+        return not self._stop_event.is_set()
+
+    def _run(self):
+        next_at = time.monotonic()
+        while self._wait_for_space():
+            delay = next_at - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            next_at = max(next_at, time.monotonic()) + self.interval
+            try:
+                init_info = self.seckill._get_seckill_init_info()
+                if 'token' not in init_info:
+                    raise ValueError(f"""返回信息中没有 token: {init_info}""")
+            except UnusableResponse as e:
+                self.failed += 1
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                if e.action == REAUTH:
+                    logger.error(f"""登录已失效, 停止预取秒杀初始化信息. Error - {str(e)}""")
+                    break
+                delay = self._policy.backoff()
+                logger.error(f"""预取秒杀初始化信息被限流, {delay * 1000:.0f} ms 后重试. Error - {str(e)}""")
+                if self._stop_event.wait(delay):
+                    break
+                next_at = time.monotonic()
+                continue
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"""预取秒杀初始化信息失败. Error - {str(e)}""")
+                continue
+            self._policy.backoffs = 0
+            with self._cond:
+                self._tokens.append((time.monotonic() + self.ttl, init_info))
+                self.fetched += 1
+                self._cond.notify_all()
+
+    def take(self, timeout=None):
+        """
+        取出一份未过期的初始化信息
+        :param timeout: 最长等待时间(秒), 默认为一个有效期
+        :return: 初始化信息, 超时或已停止时为 None
+        :raise UnusableResponse: 队列为空且最近一次获取被判定为不可用, 登录失效的错误会一直保留
+        """
+        deadline = time.monotonic() + (self.ttl if timeout is None else timeout)
+        with self._cond:
+            while True:
+                self._purge()
+                if self._tokens:
+                    init_info = self._tokens.popleft()[1]
+                    # 通知获取线程队列有空位
+                    self._cond.notify_all()
+                    return init_info
+                if self._error is not None:
+                    error = self._error
+                    if error.action != REAUTH:
+                        self._error = None
+                    raise error
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop_event.is_set():
+                    return None
+                self._cond.wait(remaining)
+
+    def start(self):
+        """
+        启动后台获取线程
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='TokenPrefetcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止后台获取线程并清空队列
+        :return:
+        """
+        self._stop_event.set()
+        with self._cond:
+            self._tokens.clear()
+            self._cond.notify_all()
+        logger.info(f"""预取初始化信息: 获取 {self.fetched} 次, 过期丢弃 {self.expired} 次, 失败 {self.failed} 次""")
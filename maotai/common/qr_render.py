@@ -0,0 +1,161 @@
+import zlib
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG 颜色类型对应的通道数: 灰度 / RGB / 调色板 / 灰度+透明 / RGBA
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _luma(r, g, b):
+    return (299 * r + 587 * g + 114 * b) // 1000
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(raw, height, stride, bpp):
+    """
+    还原 PNG 每一行的滤波
+    :param raw: 解压后的数据
+    :param height: 行数
+    :param stride: 每行字节数
+    :param bpp: 每个像素的字节数 (不足 1 字节按 1 计)
+    :return: [bytearray, ...]
+    """
+    rows = []
+    prev = bytearray(stride)
+    pos = 0
+    for _ in range(height):
+        kind = raw[pos]
+        line = bytearray(raw[pos + 1: pos + 1 + stride])
+        pos += 1 + stride
+        for i in range(stride):
+            a = line[i - bpp] if i >= bpp else 0
+            b = prev[i]
+            c = prev[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                line[i] = (line[i] + a) & 0xFF
+            elif kind == 2:
+                line[i] = (line[i] + b) & 0xFF
+            elif kind == 3:
+                line[i] = (line[i] + ((a + b) >> 1)) & 0xFF
+            elif kind == 4:
+                line[i] = (line[i] + _paeth(a, b, c)) & 0xFF
+        rows.append(line)
+        prev = line
+    return rows
+
+
+def decode_png(data):
+    """
+    解码非隔行扫描的 PNG 为灰度像素, 透明部分视为白色
+    :param data: PNG 文件内容
+    :return: [[灰度 0-255, ...], ...]
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError('不是 PNG 图片')
+    pos = 8
+    header = None
+    palette = None
+    idat = []
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[pos: pos + 8])
+        chunk = data[pos + 8: pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'PLTE':
+            palette = [_luma(*chunk[i: i + 3]) for i in range(0, len(chunk) - 2, 3)]
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+    if header is None:
+        raise ValueError('PNG 缺少 IHDR')
+    width, height, depth, color, _, _, interlace = header
+    if interlace or color not in PNG_CHANNELS or (color == 3 and palette is None):
+        raise ValueError(f"""不支持的 PNG 格式: 颜色类型 {color}, 隔行扫描 {interlace}""")
+
+    channels = PNG_CHANNELS[color]
+    bits = channels * depth
+    stride = (width * bits + 7) // 8
+    rows = _unfilter(zlib.decompress(b''.join(idat)), height, stride, max(1, bits // 8))
+
+    pixels = []
+    step = depth // 8 if depth >= 8 else 0
+    for line in rows:
+        if depth < 8:
+            mask = (1 << depth) - 1
+            values = [(line[(x * depth) >> 3] >> (8 - depth - (x * depth) % 8)) & mask for x in range(width)]
+            pixels.append([palette[v] if color == 3 else v * 255 // mask for v in values])
+            continue
+        out = []
+        for x in range(width):
+            # 16 位深度只取高位字节
+            sample = [line[(x * channels + c) * step] for c in range(channels)]
+            if color == 3:
+                value = palette[sample[0]]
+            elif color in (0, 4):
+                value = sample[0]
+            else:
+                value = _luma(*sample[:3])
+            if color in (4, 6):
+                alpha = sample[-1]
+                value = (value * alpha + 255 * (255 - alpha)) // 255
+            out.append(value)
+        pixels.append(out)
+    return pixels
+
+
+def qr_matrix(pixels, threshold=128):
+    """
+    从二维码图片中按模块取样
+    左上角定位图案的第一行宽度为 7 个模块, 据此得到模块大小
+    :param pixels: decode_png 的结果
+    :param threshold: 小于该灰度视为深色
+    :return: [[是否深色, ...], ...]
+    """
+    dark = [[value < threshold for value in row] for row in pixels]
+    rows = [y for y, row in enumerate(dark) if any(row)]
+    cols = [x for x in range(len(dark[0])) if any(row[x] for row in dark)] if rows else []
+    if not rows or not cols:
+        raise ValueError('图片中没有二维码')
+    top, bottom, left, right = rows[0], rows[-1], cols[0], cols[-1]
+    run = 0
+    while left + run <= right and dark[top][left + run]:
+        run += 1
+    size = run / 7.0
+    count = int(round((right - left + 1) / size)) if size else 0
+    if count < 21:
+        raise ValueError('无法识别二维码的模块大小')
+    return [[dark[min(bottom, int(top + (i + 0.5) * size))][min(right, int(left + (j + 0.5) * size))]
+             for j in range(count)] for i in range(count)]
+
+
+def render_terminal(matrix, invert=True, border=2):
+    """
+    用 Unicode 半块字符把二维码画在终端中, 每个字符表示上下两个模块
+    :param matrix: qr_matrix 的结果
+    :param invert: 终端为深色背景时需要反色, 用字符画出浅色模块
+    :param border: 四周空白的模块数
+    :return: str
+    """
+    count = len(matrix)
+    size = count + border * 2
+
+    def filled(i, j):
+        i, j = i - border, j - border
+        is_dark = 0 <= i < count and 0 <= j < count and matrix[i][j]
+        return is_dark != invert
+
+    blocks = {(False, False): ' ', (True, False): '▀', (False, True): '▄', (True, True): '█'}
+    lines = []
+    for i in range(0, size, 2):
+        lines.append(''.join(blocks[(filled(i, j), filled(i + 1, j) if i + 1 < size else invert)]
+                             for j in range(size)))
+    return '\n'.join(lines)
@@ -0,0 +1,183 @@
+import re
+import json
+import html
+from urllib.parse import urlsplit
+
+from maotai.common.exception import UnusableResponse
+from maotai.common.retry import BACKOFF, REAUTH
+
+# 响应可以解析
+PARSE = 'parse'
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+# 京东登录页: 只认 passport 域名下的登录路径, 页面中普通的登录链接 / login.js 不算
+LOGIN_HOST = 'passport.jd.com'
+LOGIN_PATHS = ('/new/login', '/uc/login')
+# HTML 页面通过脚本或 meta refresh 跳转到登录页
+LOGIN_REDIRECT_PATTERN = re.compile(
+    rb'(?:location(?:\.href)?\s*=|location\.replace\(|url=)\s*["\']?(?:https?:)?//passport\.jd\.com/(?:new|uc)/login',
+    re.IGNORECASE)
+# 判断响应类型时最多查看的响应体字节数
+CLASSIFY_PREFIX_SIZE = 1024
+
+# 第一次解析时才确定使用 orjson 还是标准库 json, 不拖慢启动
+_loads = None
+
+
+def _json_loads(content):
+    """
+    使用标准库解析 JSON
+    :param content: bytes / memoryview
+    :return:
+    """
+    return json.loads(bytes(content))
+
+
+def _resolve_loads():
+    """
+    导入 orjson, 不可用时回退到标准库 json
+    :return: 解析函数
+    """
+    global _loads
+    try:
+        import orjson
+        _loads = orjson.loads
+    except ImportError:
+        _loads = _json_loads
+    return _loads
+
+
+def json_backend():
+    """
+    当前使用的 JSON 解析库
+    :return: 'orjson' / 'json'
+    """
+    return 'json' if (_loads or _resolve_loads()) is _json_loads else 'orjson'
+
+
+def decode_json(content):
+    """
+    直接在 bytes 上解析 JSON / JSONP ( jQuery123({...}) ), 不经过字符集检测
+    JSONP 外层通过 memoryview 切片去掉, 不复制响应体
+    :param content: 响应体 bytes
+    :return: 解析后的 dict
+    """
+    begin = content.find(b'{')
+    end = content.rfind(b'}') + 1
+    if begin < 0 or end <= begin:
+        raise ValueError(f"""响应中没有 JSON 内容: {preview(content)}""")
+    loads = _loads or _resolve_loads()
+    if begin == 0 and end == len(content):
+        return loads(content)
+    return loads(memoryview(content)[begin:end])
+
+
+TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+def read_title(resp, chunk_size=4096, max_bytes=262144):
+    """
+    流式读取 HTML 页面的 <title>, 读到 </title> 后立即关闭连接, 不下载和解析整个页面
+    需要以 stream=True 发起请求
+    :param resp: requests 的响应
+    :param chunk_size: 每次读取的字节数
+    :param max_bytes: 最多读取的字节数
+    :return: title, 未找到时为 None
+    """
+    buffer = bytearray()
+    match = None
+    try:
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            # 从上一块末尾往前留出余量, </title> 可能跨块
+            start = max(0, len(buffer) - 16)
+            buffer += chunk
+            if buffer.find(b'</', start) >= 0:
+                match = TITLE_PATTERN.search(buffer)
+                if match:
+                    break
+            if len(buffer) >= max_bytes:
+                break
+    finally:
+        resp.close()
+    if match is None:
+        return None
+    # 优先使用 headers 中的字符集, 其次是 <title> 之前的 <meta charset>
+    charset = None
+    if 'charset' in resp.headers.get('Content-Type', '').lower():
+        charset = resp.encoding
+    if charset is None:
+        meta = CHARSET_PATTERN.search(buffer, 0, match.start())
+        charset = meta.group(1).decode('ascii') if meta else 'utf-8'
+    try:
+        title = match.group(1).decode(charset, 'replace')
+    except LookupError:
+        title = match.group(1).decode('utf-8', 'replace')
+    return html.unescape(title).strip()
+
+
+def classify_response(status_code, headers, content):
+    """
+    解析前根据状态码 / Location / Content-Type / 响应体开头判断响应是否可用
+    只查看响应体的前 CLASSIFY_PREFIX_SIZE 个字节, 不解码
+    :param status_code: HTTP 状态码
+    :param headers: 响应 headers
+    :param content: 响应体 bytes
+    :return: (动作 PARSE / REAUTH / BACKOFF, 原因)
+    """
+    if status_code in REDIRECT_STATUS_CODES:
+        location = headers.get('Location') or ''
+        target = urlsplit(location)
+        if target.hostname == LOGIN_HOST and target.path.lower().startswith(LOGIN_PATHS):
+            return REAUTH, f"""跳转到登录页 {location}"""
+        return BACKOFF, f"""跳转到 {location}"""
+    if status_code == 401:
+        return REAUTH, f"""HTTP {status_code}"""
+    if status_code >= 400:
+        return BACKOFF, f"""HTTP {status_code}"""
+
+    head = content[:CLASSIFY_PREFIX_SIZE].lstrip()
+    if not head:
+        return BACKOFF, '响应为空'
+    first = head[:1]
+    if first == b'{' or first == b'[':
+        return PARSE, None
+    content_type = (headers.get('Content-Type') or '').lower()
+    if first == b'<' or ('html' in content_type and b'{' not in head):
+        # 先用 find 排除绝大多数页面, 再用正则确认是跳转而不是链接
+        if head.find(b'passport.jd.com/') >= 0 and LOGIN_REDIRECT_PATTERN.search(head):
+            return REAUTH, '返回了跳转登录页的页面'
+        return BACKOFF, f"""返回了 HTML 页面: {preview(head, 64)}"""
+    # JSONP: jQuery123({...})
+    if b'{' in head:
+        return PARSE, None
+    return BACKOFF, f"""无法识别的响应: {preview(head, 64)}"""
+
+
+def check_response(resp):
+    """
+    不可用的响应直接抛出 UnusableResponse, 不再解析
+    :param resp: requests / httpx 的响应
+    :return:
+    """
+    action, reason = classify_response(resp.status_code, resp.headers, resp.content)
+    if action != PARSE:
+        raise UnusableResponse(action, reason)
+
+
+def parse_response(resp):
+    """
+    解析京东接口返回的 JSON / JSONP, 京东接口均为 UTF-8 编码, 直接使用 resp.content
+    :param resp: requests / httpx 的响应
+    :return: 解析后的 dict
+    """
+    return decode_json(resp.content)
+
+
+def preview(content, size=128):
+    """
+    响应体的前 size 个字节, 用于日志
+    :param content: 响应体 bytes
+    :param size: 字节数
+    :return: str
+    """
+    return content[0: size].decode('utf-8', 'replace')
@@ -0,0 +1,40 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+@dataclass
+class PurchaseResult(object):
+    """
+    一次抢购的结果
+    """
+    # 是否抢购成功
+    success: bool = False
+    # 订单号 / 总价 / 电脑端付款链接, 抢购成功时才有
+    order_id: Optional[int] = None
+    total_money: Optional[str] = None
+    pay_url: Optional[str] = None
+    # 最后一次提交的结果码, 无法解析结果时为 None
+    result_code: Optional[int] = None
+    # 停止抢购的原因
+    reason: str = ''
+    # 提交次数
+    attempts: int = 0
+    # 抢购时间 (京东服务器时间戳 ms), 实际触发时刻 (本地时间戳 ms)
+    buy_time_ms: Optional[int] = None
+    triggered_at_ms: Optional[float] = None
+    # 触发到停止的耗时 / 每次提交的耗时 (ms)
+    elapsed_ms: float = 0.0
+    latencies_ms: List[float] = field(default_factory=list)
+
+    def __bool__(self):
+        return self.success
+
+    def summary(self):
+        """
+        用于日志输出的概要
+        :return:
+        """
+        avg = sum(self.latencies_ms) / len(self.latencies_ms) if self.latencies_ms else 0.0
+        head = f"""抢购成功, 订单号: {self.order_id}, 总价: {self.total_money}""" if self.success else '抢购失败'
+        return (f"""{head}, 停止原因: {self.reason}, 提交 {self.attempts} 次, 平均耗时 {avg:.1f} ms, """
+                f"""总耗时 {self.elapsed_ms:.1f} ms""")
@@ -0,0 +1,123 @@
+import time
+import random
+from collections import namedtuple
+
+import requests
+
+from maotai.common.config import env_params, get_settings
+from maotai.common.exception import SKException
+
+# 停止抢购
+STOP = 'stop'
+# 立即重试
+RETRY = 'retry'
+# 按指数退避等待后重试
+BACKOFF = 'backoff'
+# 重新获取秒杀初始化信息后重试
+REFRESH = 'refresh'
+# 登录已失效, 需要重新登录 (抢购中无法完成, 按停止处理)
+REAUTH = 'reauth'
+
+ACTIONS = (STOP, RETRY, BACKOFF, REFRESH)
+
+# 提交结果码对应的动作, 未列出的失败结果码视为初始化信息过期
+# 0 - 抢购成功 60074 - 很遗憾没有抢到 60017 - 提交过快 90013 - 系统开小差
+DEFAULT_RULES = {
+    0: STOP,
+    60074: STOP,
+    60017: BACKOFF,
+    90013: RETRY,
+}
+
+# 动作, 等待时间(秒), 原因
+RetryDecision = namedtuple('RetryDecision', ['action', 'delay', 'reason'])
+
+
+class RetryPolicy(object):
+    """
+    重试策略: 根据提交结果码或异常决定下一步动作, 超过总时限或提交次数上限后停止
+    """
+
+    def __init__(self, deadline=None, rules=None, backoff_base_ms=None, backoff_max_ms=None, max_attempts=None):
+        """
+        :param deadline: 开始后最长重试时间(秒), None 或 0 为不限制
+        :param rules: {结果码: 动作}, 覆盖默认规则
+        :param backoff_base_ms: 第一次退避的等待时间(ms), 之后每次翻倍
+        :param backoff_max_ms: 退避等待时间上限(ms)
+        :param max_attempts: 最多提交次数, None 或 0 为不限制
+        """
+        settings = get_settings()
+        self.rules = dict(DEFAULT_RULES)
+        for code, action in (rules or env_params.get('RETRY_RULES') or {}).items():
+            if action not in ACTIONS:
+                raise SKException(f"""结果码 {code} 的重试动作 {action} 无效, 可选: {', '.join(ACTIONS)}""")
+            self.rules[int(code)] = action
+        self.deadline = deadline if deadline is not None else settings.retry_deadline
+        self.max_attempts = max_attempts if max_attempts is not None else settings.retry_max_attempts
+        self.backoff_base = (backoff_base_ms if backoff_base_ms is not None else settings.retry_backoff_base_ms) / 1000.0
+        self.backoff_max = (backoff_max_ms if backoff_max_ms is not None else settings.retry_backoff_max_ms) / 1000.0
+        self.expire_at = None
+        self.backoffs = 0
+        self.attempts = 0
+        self.start()
+
+    def start(self):
+        """
+        从现在开始计算总时限
+        :return:
+        """
+        self.expire_at = time.monotonic() + self.deadline if self.deadline else None
+        self.backoffs = 0
+        self.attempts = 0
+
+    def remaining(self):
+        """
+        距离总时限的剩余时间(秒)
+        :return: 不限制时为 None
+        """
+        if self.expire_at is None:
+            return None
+        return self.expire_at - time.monotonic()
+
+    def backoff(self):
+        """
+        指数退避的等待时间, 在上限内加入随机抖动, 每次调用翻倍
+        :return: 等待时间(秒)
+        """
+        delay = min(self.backoff_base * (2 ** self.backoffs), self.backoff_max)
+        self.backoffs += 1
+        return random.uniform(delay / 2, delay)
+
+    def decide(self, code=None, error=None):
+        """
+        根据本次提交的结果决定下一步动作
+        异常或无法解析结果时不清楚服务端状态, 重新获取初始化信息前同样退避等待
+        响应被判定为登录页时停止, 限流页 / 错误页退避后重试
+        :param code: 提交结果码, 成功为 0, 无法解析结果时为 None
+        :param error: 提交时抛出的异常
+        :return: RetryDecision
+        """
+        self.attempts += 1
+        if error is not None:
+            # UnusableResponse 已给出动作
+            action = getattr(error, 'action', None)
+            if action == REAUTH:
+                return RetryDecision(STOP, 0.0, f"""登录已失效, 请重新登录: {str(error)}""")
+            if action != BACKOFF:
+                action = BACKOFF if isinstance(error, requests.RequestException) else REFRESH
+            reason, throttle = f"""提交异常: {str(error)}""", True
+        elif code is None:
+            action, reason, throttle = REFRESH, '无法解析提交结果', True
+        else:
+            action = self.rules.get(code, REFRESH)
+            reason, throttle = f"""结果码 {code}""", action == BACKOFF
+
+        delay = self.backoff() if throttle else 0.0
+        if not throttle:
+            self.backoffs = 0
+        remaining = self.remaining()
+        if action != STOP and remaining is not None and remaining <= delay:
+            return RetryDecision(STOP, 0.0, f"""{reason}, 已超过重试总时限 {self.deadline} 秒""")
+        if action != STOP and self.max_attempts and self.attempts >= self.max_attempts:
+            return RetryDecision(STOP, 0.0, f"""{reason}, 已达到提交次数上限 {self.max_attempts} 次""")
+        return RetryDecision(action, delay, reason)
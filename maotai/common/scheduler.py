@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import socketserver
+from datetime import datetime, timedelta
+
+from maotai.common.clock import ClockSynchronizer
+from maotai.common.config import env_params, get_settings
+from maotai.common.exception import SKException
+from maotai.common.session_keeper import SessionKeeper
+from maotai.logger.logutil import logger
+
+# 可以定时执行或手动触发的任务
+JOBS = ('order', 'buy')
+# 抢购方式: 同步 / 异步并发 / 多进程
+BUY_MODES = ('sync', 'async', 'multi_process')
+# 命令队列中表示退出的标记
+STOP_JOB = 'stop'
+
+
+def next_time_of_day(time_of_day, now=None):
+    """
+    下一次到达每天的某个时间
+    :param time_of_day: HH:MM:SS.fff
+    :param now: 当前时间, 默认为 datetime.now()
+    :return: datetime
+    """
+    now = now or datetime.now()
+    moment = datetime.combine(now.date(), datetime.strptime(time_of_day, '%H:%M:%S.%f').time())
+    return moment if moment > now else moment + timedelta(days=1)
+
+
+def send_command(command, socket_path=None, timeout=5):
+    """
+    向运行中的常驻进程发送命令
+    :param command: 命令及参数, 如 ['trigger', 'buy']
+    :param socket_path: 控制 socket 路径, 默认读取配置 DAEMON_SOCKET
+    :param timeout: 超时时间(秒)
+    :return: 常驻进程返回的 dict
+    """
+    socket_path = socket_path or env_params.get('DAEMON_SOCKET') or 'seckill.sock'
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            client.sendall((' '.join(command) + '\n').encode('utf-8'))
+            reply = b''
+            while not reply.endswith(b'\n'):
+                chunk = client.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+    except OSError as e:
+        return {'ok': False, 'error': f"""无法连接常驻进程 {socket_path}: {str(e)}"""}
+    try:
+        return json.loads(reply)
+    except ValueError as e:
+        # 常驻进程在回复前退出或回复被截断
+        return {'ok': False, 'error': f"""常驻进程返回了无法解析的回复 {reply[:200]!r}: {str(e)}"""}
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """
+    每个连接读取一行命令, 返回一行 JSON
+    """
+
+    def handle(self):
+        command = self.rfile.readline(1024).decode('utf-8', 'replace').split()
+        try:
+            reply = self.server.scheduler.handle_command(command)
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+        self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class SeckillScheduler(object):
+    """
+    常驻进程: 每天按配置的 ORDER_TIME 预约, 在 BUY_TIME 之前 prepare_seconds 开始抢购流程
+    两次抢购之间保留登录会话与时钟同步, 空闲时后台验证登录状态
+    通过 Unix domain socket 接收 status / trigger order|buy / stop 命令
+    任务在主线程中依次执行, 执行期间收到的 trigger / stop 在当前任务结束后处理
+    """
+
+    def __init__(self, seckill, socket_path=None, mode=None, prepare_seconds=None, order_deadline=None,
+                 idle_clock_interval=None):
+        """
+        :param seckill: Seckill, 抢购方式为 async 时需为 AsyncSeckill
+        :param socket_path: 控制 socket 路径
+        :param mode: 抢购方式 sync / async / multi_process
+        :param prepare_seconds: 距离抢购时间多少秒开始抢购流程 (时钟同步 / 登录验证 / 预热)
+        :param order_deadline: 预约最长重试时间(秒)
+        :param idle_clock_interval: 空闲时的时钟同步间隔(秒), 抢购流程中恢复为 CLOCK_SYNC_INTERVAL
+        """
+        self.seckill = seckill
+        self.settings = get_settings()
+        self.socket_path = socket_path or env_params.get('DAEMON_SOCKET') or 'seckill.sock'
+        self.mode = mode or env_params.get('DAEMON_BUY_MODE') or 'sync'
+        if self.mode not in BUY_MODES:
+            raise SKException(f"""抢购方式 {self.mode} 无效, 可选: {', '.join(BUY_MODES)}""")
+        self.prepare_seconds = prepare_seconds if prepare_seconds is not None else self.settings.daemon_prepare_seconds
+        self.order_deadline = order_deadline if order_deadline is not None else self.settings.daemon_order_deadline
+        self.idle_clock_interval = (idle_clock_interval if idle_clock_interval is not None
+                                    else self.settings.daemon_clock_sync_interval)
+        self.clock = ClockSynchronizer(interval=self.idle_clock_interval)
+        self.clock_interval = self.settings.clock_sync_interval
+
+        self.started_at = time.time()
+        self.current_job = None
+        self.next_job = None
+        # {任务: 最近一次执行的记录}
+        self.last_runs = {}
+        # {任务: 最近一次按计划执行的时刻}, 同一时刻不重复执行
+        self.completed = {}
+        self.commands = queue.Queue()
+        self.lock = threading.Lock()
+        self.keeper = None
+        self.keeper_buy_time = None
+        self.server = None
+
+    def _next_time(self, job, time_of_day, now):
+        """
+        任务下一次按计划执行的时刻, 跳过已执行过的时刻
+        :param job: 任务
+        :param time_of_day: HH:MM:SS.fff
+        :param now: 当前时间
+        :return: datetime
+        """
+        completed = self.completed.get(job)
+        return next_time_of_day(time_of_day, max(now, completed) if completed else now)
+
+    def _schedule(self, now=None):
+        """
+        下一个定时任务
+        抢购流程在抢购时间之前 prepare_seconds 开始, 但不早于抢购当天零点 (Adjuster 按当天日期计算抢购时间)
+        :param now: 当前时间
+        :return: (任务, 开始时间, 计划时刻)
+        """
+        now = now or datetime.now()
+        buy_at = self._next_time('buy', self.settings.buy_time, now)
+        midnight = datetime.combine(buy_at.date(), datetime.min.time())
+        jobs = [('buy', max(buy_at - timedelta(seconds=self.prepare_seconds), midnight), buy_at)]
+        if self.settings.order_time:
+            order_at = self._next_time('order', self.settings.order_time, now)
+            jobs.append(('order', order_at, order_at))
+        return min(jobs, key=lambda job: job[1])
+
+    def _keep_session(self):
+        """
+        空闲时在后台验证登录状态, 抢购时间变化后重新启动
+        :return:
+        """
+        buy_at = self._next_time('buy', self.settings.buy_time, datetime.now())
+        if self.keeper is not None and self.keeper_buy_time == buy_at:
+            return
+        self._stop_keeper()
+        self.keeper = SessionKeeper(self.seckill.qr_login, buy_at.timestamp() * 1000.0)
+        self.keeper_buy_time = buy_at
+        self.keeper.start()
+
+    def _stop_keeper(self):
+        """
+        执行任务前停止后台验证, 任务中的请求不与验证请求并发
+        :return:
+        """
+        if self.keeper is not None:
+            self.keeper.stop()
+            self.keeper = None
+            self.keeper_buy_time = None
+
+    def _buy(self):
+        """
+        按配置的抢购方式执行一次抢购, 期间按 CLOCK_SYNC_INTERVAL 同步时钟
+        :return: (是否成功, 结果说明)
+        """
+        self.clock.interval = self.clock_interval
+        try:
+            try:
+                self.clock.update()
+            except Exception as e:
+                logger.error(f"""抢购前时钟同步失败, 使用已有的时钟模型. Error - {str(e)}""")
+            if self.mode == 'multi_process':
+                reports = self.seckill.buy_by_multi_process()
+                order_ids = [report.order_id for report in reports if report.order_id]
+                return bool(order_ids), f"""{len(reports)} 个进程, 订单号 {order_ids or '无'}"""
+            result = self.seckill.buy()
+            return result.success, result.summary()
+        finally:
+            self.clock.interval = self.idle_clock_interval
+
+    def run_job(self, job):
+        """
+        执行任务并记录结果, 任务失败不影响常驻进程
+        :param job: order / buy
+        :return:
+        """
+        with self.lock:
+            self.current_job = job
+        self._stop_keeper()
+        started_at = time.time()
+        logger.info(f"""开始执行任务: {job}""")
+        try:
+            if job == 'order':
+                success = self.seckill.order(self.order_deadline)
+                detail = '预约成功' if success else '预约失败'
+            else:
+                success, detail = self._buy()
+        except Exception as e:
+            success, detail = False, f"""任务异常: {str(e)}"""
+            logger.error(f"""任务 {job} 执行失败. Error - {str(e)}""")
+        finished_at = time.time()
+        logger.info(f"""任务 {job} 结束, 耗时 {finished_at - started_at:.1f} 秒: {detail}""")
+        with self.lock:
+            self.current_job = None
+            self.last_runs[job] = {
+                'started_at': datetime.fromtimestamp(started_at).isoformat(timespec='milliseconds'),
+                'finished_at': datetime.fromtimestamp(finished_at).isoformat(timespec='milliseconds'),
+                'success': success,
+                'detail': detail,
+            }
+
+    def status(self):
+        """
+        常驻进程的当前状态
+        :return: dict
+        """
+        clock = self.clock
+        with self.lock:
+            return {
+                'ok': True,
+                'pid': os.getpid(),
+                'uptime_s': round(time.time() - self.started_at),
+                'account': self.seckill.session_util.account,
+                'login': bool(self.seckill.qr_login.is_login),
+                'mode': self.mode,
+                'running': self.current_job,
+                'next': self.next_job,
+                'clock': {
+                    'offset_ms': round(clock.offset_ms, 3),
+                    'uncertainty_ms': None if clock.uncertainty_ms is None else round(clock.uncertainty_ms, 3),
+                    'drift_ppm': round(clock.drift_ppm, 3),
+                },
+                'last_runs': dict(self.last_runs),
+            }
+
+    def handle_command(self, command):
+        """
+        处理控制命令, 在 socket 线程中执行
+        :param command: 命令及参数
+        :return: 返回给客户端的 dict
+        """
+        name = command[0] if command else ''
+        if name == 'status':
+            return self.status()
+        if name == 'trigger':
+            job = command[1] if len(command) > 1 else ''
+            if job not in JOBS:
+                return {'ok': False, 'error': f"""未知任务 {job}, 可选: {', '.join(JOBS)}"""}
+            with self.lock:
+                running = self.current_job
+            self.commands.put(job)
+            if running:
+                return {'ok': True, 'message': f"""正在执行 {running}, {job} 将在其结束后执行"""}
+            return {'ok': True, 'message': f"""开始执行 {job}"""}
+        if name == 'stop':
+            self.commands.put(STOP_JOB)
+            return {'ok': True, 'message': '常驻进程将在当前任务结束后退出'}
+        return {'ok': False, 'error': f"""未知命令 {name}, 可选: status / trigger order|buy / stop"""}
+
+    def start_control(self):
+        """
+        在后台线程中监听控制 socket
+        :return:
+        """
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            raise SKException('当前系统不支持 Unix domain socket, 无法启动常驻进程.')
+        if os.path.exists(self.socket_path):
+            if send_command(['status'], self.socket_path, timeout=1).get('ok'):
+                raise SKException(f"""已有常驻进程在运行: {self.socket_path}""")
+            # 上次异常退出留下的 socket 文件
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, ControlHandler)
+        self.server.daemon_threads = True
+        self.server.scheduler = self
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self.server.serve_forever, name='ControlServer', daemon=True).start()
+        logger.info(f"""控制 socket 已启动: {self.socket_path}""")
+
+    def stop_control(self):
+        """
+        关闭控制 socket
+        :return:
+        """
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+    def run(self):
+        """
+        常驻运行, 直到收到 stop 命令
+        :return:
+        """
+        self.start_control()
+        self.seckill.clock = self.clock.start()
+        try:
+            if not self.seckill.qr_login.is_login:
+                self.seckill.login_by_qrcode()
+            while True:
+                job, start_at, planned_at = self._schedule()
+                with self.lock:
+                    self.next_job = {'job': job, 'start_at': start_at.isoformat(timespec='milliseconds'),
+                                     'planned_at': planned_at.isoformat(timespec='milliseconds')}
+                self._keep_session()
+                # 最多等待 60 秒重新计算, 系统时间调整后不会错过任务
+                delay = (start_at - datetime.now()).total_seconds()
+                try:
+                    command = self.commands.get(timeout=min(max(delay, 0.0), 60.0))
+                except queue.Empty:
+                    command = None
+                if command == STOP_JOB:
+                    break
+                if command is not None:
+                    self.run_job(command)
+                elif start_at <= datetime.now():
+                    self.completed[job] = planned_at
+                    self.run_job(job)
+        finally:
+            self._stop_keeper()
+            self.clock.stop()
+            self.stop_control()
+            logger.info('常驻进程已退出.')
@@ -1,23 +1,40 @@
 import os
 import time
-import json
 import random
-import pickle
 import functools
+import subprocess
+from urllib.parse import urlencode, quote_plus
 
-from lxml import etree
 import requests
 # import timer
-from concurrent.futures import ProcessPoolExecutor
 
-from maotai.common.util import get_useragent, parse_json, wait_time
-from maotai.common.config import env_params
-from maotai.logger.logutil import logger
-from maotai.common.exception import SKException
+from maotai.common.adjuster import Adjuster
+from maotai.common.connection import ConnectionManager
+from maotai.common.cookie_store import CookieStore, METADATA_SUFFIX
+from maotai.common.governor import GovernedSession, governor
+from maotai.common.metadata import MetadataCache
+from maotai.common.prefetch import TokenPrefetcher
+from maotai.common.qr_render import decode_png, qr_matrix, render_terminal
+from maotai.common.session_keeper import SessionKeeper
+from maotai.common.trace import tracer
+from maotai.common.result import PurchaseResult
+from maotai.common.response import parse_response, decode_json, preview, read_title, check_response
+from maotai.common.retry import RetryPolicy, STOP, REFRESH, REAUTH
+from maotai.common.util import get_useragent, wait_time
+from maotai.common.config import env_params, get_settings
+from maotai.logger.logutil import logger, events
+from maotai.common.exception import SKException, UnusableResponse
 
 COOKIE_FOLDER = './cookies/'
 QR_FILE = 'qr_code.png'
 
+# 扫码登录状态: 201 未扫描 202 已扫描待确认 203 二维码过期 205 已取消
+QR_SCANNED = 202
+QR_EXPIRED_CODES = (203, 205)
+
+# 提交过快, 视为被服务端限流
+SUBMIT_TOO_FAST = 60017
+
 
 class SessionUtil(object):
     """
@@ -26,15 +43,20 @@ class SessionUtil(object):
 
     def __init__(self):
         self.cookies_folder = COOKIE_FOLDER
+        self.cookie_store = CookieStore(self.cookies_folder)
+        # 当前 cookies 所属的账号及其保存记录, 未加载 / 未保存时为 None
+        self.account = None
+        self.cookie_record = None
         self.user_agent = get_useragent()
         self.session = self._init_session()
+        self.connection_manager = ConnectionManager(self.session)
 
     def _init_session(self):
         """
         初始化 Session
         :return:
         """
-        session = requests.session()
+        session = GovernedSession()
         session.headers = self.get_headers()
         return session
 
@@ -83,34 +105,44 @@ class SessionUtil(object):
 
     def load_cookies_from_local(self):
         """
-        从本地加载 Cookies
-        :return:
+        从本地加载 Cookies, 优先加载配置 COOKIE_ACCOUNT 指定的账号, 否则加载最近一次保存的账号
+        :return: 是否加载成功
         """
-        cookies_file = ''
-        if not os.path.exists(self.cookies_folder):
+        account = env_params.get('COOKIE_ACCOUNT') or self.cookie_store.current_account()
+        if not account:
             return False
-        for name in os.listdir(self.cookies_folder):
-            if name.endswith('.cookies'):
-                cookies_file = f"""{self.cookies_folder}{name}"""
-                break
-        if cookies_file == '':
+        record = self.cookie_store.load(account)
+        if record is None:
             return False
-        with open(cookies_file, 'rb') as f:
-            local_cookies = pickle.load(f)
-        self.set_cookies(local_cookies)
+        self.set_cookies(record.cookies)
+        self.account = account
+        self.cookie_record = record
+        return True
 
     def save_cookies_to_local(self, cookie_file_name):
         """
-        保存 Cookies 到本地文件
-        :param cookie_file_name: 文件名
+        保存 Cookies 到本地文件, 只在验证登录有效后调用
+        :param cookie_file_name: 账号
         :return:
         """
-        cookies_file = f"""{self.cookies_folder}{cookie_file_name}.cookies"""
-        directory = os.path.dirname(cookies_file)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        with open(cookies_file, 'wb', encoding='utf-8') as f:
-            pickle.dump(self.get_cookies(), f)
+        self.cookie_record = self.cookie_store.save(cookie_file_name, self.get_cookies())
+        self.account = cookie_file_name
+
+    def cookies_fresh(self):
+        """
+        本地加载的 cookies 是否在信任时间内验证过且未过期, 是则无需联网验证
+        :return:
+        """
+        return self.cookie_store.is_fresh(self.cookie_record)
+
+    def metadata_file(self):
+        """
+        当前账号的信息缓存文件, 与 cookies 文件放在一起
+        :return: 未确定账号时为 None
+        """
+        if self.account is None:
+            return None
+        return self.cookie_store.path(self.account, METADATA_SUFFIX)
 
 
 class QRLogin(object):
@@ -119,11 +151,21 @@ class QRLogin(object):
     """
     def __init__(self, session_util: SessionUtil):
         self.qrcode_image_file = QR_FILE
+        # 最近一次查询到的扫码状态
+        self.qrcode_status = None
         self.session_util = session_util
         self.session = self.session_util.get_session()
 
         self.is_login = False
-        self.refresh_login_status()
+        if self.session_util.cookies_fresh():
+            # 最近验证过且未过期, 省去一次联网验证
+            self.is_login = True
+            logger.info('本地 cookies 在有效期内, 跳过登录验证.')
+        else:
+            self.refresh_login_status()
+            # 本地 cookies 验证有效, 更新验证时间
+            if self.is_login and self.session_util.account:
+                self.session_util.save_cookies_to_local(self.session_util.account)
 
     def refresh_login_status(self):
         """
@@ -169,28 +211,58 @@ class QRLogin(object):
             logger.error('检索二维码失败.')
             return False
 
+        image = resp.content
         with open(self.qrcode_image_file, 'wb') as f:
-            for chunk in resp.iter_content(chunk_size=1024):
-                f.write(chunk)
+            f.write(image)
 
         logger.info('检索二维码成功. 请打开APP扫描登陆...')
+        self._show_qrcode(image)
+        return True
 
+    def _show_qrcode(self, image):
+        """
+        展示二维码, 不阻塞登录流程
+        QR_DISPLAY: auto 优先在终端中显示, 无法识别图片时打开图片查看器 / terminal 只在终端中显示 / viewer 只打开图片查看器
+        :param image: 二维码图片 bytes
+        :return:
+        """
+        mode = env_params.get('QR_DISPLAY') or 'auto'
+        if mode in ('auto', 'terminal'):
+            try:
+                matrix = qr_matrix(decode_png(image))
+                print(render_terminal(matrix, invert=env_params.get('QR_TERMINAL_INVERT', True)), flush=True)
+                return
+            except Exception as e:
+                logger.error(f"""无法在终端中显示二维码, 请打开 {self.qrcode_image_file} 扫描. Error - {str(e)}""")
+                if mode == 'terminal':
+                    return
+        self._open_viewer()
+
+    def _open_viewer(self):
+        """
+        在后台打开图片查看器, 不等待窗口关闭
+        :return:
+        """
         if os.name == "nt":
-            os.system('start ' + self.qrcode_image_file)  # for Windows
-        else:
-            if os.uname()[0] == "Linux":
-                if "deepin" in os.uname()[2]:
-                    os.system("deepin-image-viewer " + self.qrcode_image_file)  # for deepin
-                else:
-                    os.system("eog " + self.qrcode_image_file)  # for Linux
+            os.startfile(self.qrcode_image_file)  # for Windows
+            return
+        if os.uname()[0] == "Linux":
+            if "deepin" in os.uname()[2]:
+                command = ["deepin-image-viewer", self.qrcode_image_file]  # for deepin
             else:
-                os.system("open " + self.qrcode_image_file)  # for Mac
-        return True
+                command = ["eog", self.qrcode_image_file]  # for Linux
+        else:
+            command = ["open", self.qrcode_image_file]  # for Mac
+        try:
+            subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            logger.error(f"""打开图片查看器失败, 请手动打开 {self.qrcode_image_file} 扫描. Error - {str(e)}""")
 
     def _get_qrcode_ticket(self):
         """
-        返回用户扫描二维码登录成功之后的 ticket
-        :return:
+        查询扫码状态
+        :return: (状态码, 登录成功之后的 ticket), 请求失败时状态码为 None
         """
         payload = {
             'appid': '133',
@@ -206,15 +278,17 @@ class QRLogin(object):
 
         if not (resp.status_code == requests.codes.OK):
             logger.error('检索二维码登陆状态失败.')
-            return False
+            return None, None
 
-        resp_json = parse_json(resp.text)
+        resp_json = parse_response(resp)
         if resp_json['code'] != 200:
-            logger.info(f"""Code: {resp_json['code']}, Message: {resp_json['msg']}""")
-            return False
+            if resp_json['code'] != self.qrcode_status:
+                logger.info(f"""Code: {resp_json['code']}, Message: {resp_json['msg']}""")
+            self.qrcode_status = resp_json['code']
+            return resp_json['code'], None
         else:
             logger.info('二维码登陆成功.')
-            return resp_json['ticket']
+            return resp_json['code'], resp_json['ticket']
 
     def _verify_qr_ticket(self, ticket):
         """
@@ -235,7 +309,7 @@ class QRLogin(object):
         if not (resp.status_code == requests.codes.OK):
             logger.error('验证二维码登陆成功返回的 Ticket 失败...')
             return False
-        resp_json = json.loads(resp.text)
+        resp_json = parse_response(resp)
         if resp_json['returnCode'] == 0:
             return True
         else:
@@ -253,13 +327,25 @@ class QRLogin(object):
             raise SKException('二维码下载失败.')
 
         # Get QR code's ticket
+        # 刚展示二维码和扫码后等待确认时频繁查询, 长时间未扫码逐渐放慢
+        settings = get_settings()
+        min_interval = settings.qr_poll_min_interval
+        max_interval = settings.qr_poll_max_interval
+        deadline = time.monotonic() + settings.qr_login_timeout
+        interval = min_interval
         ticket = None
-        retry_times = 85
-        for _ in range(retry_times):
-            ticket = self._get_qrcode_ticket()
+        while time.monotonic() < deadline:
+            code, ticket = self._get_qrcode_ticket()
             if ticket:
                 break
-            time.sleep(4)
+            if code in QR_EXPIRED_CODES:
+                logger.info('二维码已失效, 重新获取二维码...')
+                if not self._get_qrcode():
+                    raise SKException('二维码下载失败.')
+                interval = min_interval
+                continue
+            interval = min_interval if code == QR_SCANNED else min(interval * 1.5, max_interval)
+            time.sleep(interval)
 
         if not ticket:
             raise SKException('二维码登陆超时，请重新扫描登陆...')
@@ -272,22 +358,105 @@ class QRLogin(object):
         logger.info('二维码登录成功!!!')
 
 
+class SubmitOrderTemplate(object):
+    """
+    预先生成的提交订单请求 (url, headers, 表单请求体)
+    每次提交只替换 token, Referer 中的 rid 以及 Cookie, 不再重新编码表单和合并 headers
+    """
+    __slots__ = ('prepared', 'body_prefix', 'body_suffix', 'sku_settings', 'send_kwargs')
+
+    def __init__(self, session, url, payload, headers, order_data, sku_settings):
+        request = requests.Request('POST', url, params=payload, headers=headers)
+        self.prepared = session.prepare_request(request)
+        self.prepared.headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        # 与 requests 一致, 值为 None 的字段不提交
+        fields = [(k, v) for k, v in order_data.items() if v is not None]
+        keys = [k for k, _ in fields]
+        index = keys.index('token')
+        prefix = urlencode(fields[:index])
+        suffix = urlencode(fields[index + 1:])
+        self.body_prefix = (prefix + '&' if prefix else '') + 'token='
+        self.body_suffix = '&' + suffix if suffix else ''
+        self.sku_settings = sku_settings
+        # 代理 / 证书等设置只合并一次
+        self.send_kwargs = session.merge_environment_settings(self.prepared.url, {}, None, None, None)
+
+    def prepare(self, token, rid, cookies):
+        """
+        填入本次提交的易变字段
+        :param token: 秒杀初始化信息中的 token
+        :param rid: 时间戳 (秒)
+        :param cookies: 当前 cookies
+        :return: PreparedRequest
+        """
+        prepared = self.prepared
+        body = (self.body_prefix + quote_plus(str(token)) + self.body_suffix).encode('utf-8')
+        prepared.body = body
+        headers = prepared.headers
+        headers['Content-Length'] = str(len(body))
+        headers['Referer'] = self.sku_settings.submit_order_refer(rid)
+        headers.pop('Cookie', None)
+        prepared.prepare_cookies(cookies)
+        return prepared
+
+
 class Seckill(object):
     def __init__(self):
-        self.session_util = SessionUtil()
-        self.session_util.load_cookies_from_local()
-        self.qr_login = QRLogin(self.session_util)
+        session_util = SessionUtil()
+        session_util.load_cookies_from_local()
+        self._init_state(session_util, QRLogin(session_util), get_settings().sku_id, 2)
+
+    def _init_state(self, session_util, qr_login, sku_id, seckill_num, seckill_init_info=None, seckill_order_data=None):
+        """
+        初始化抢购状态, Seckill 与抢购进程中的 SeckillWorker 共用
+        :param session_util: SessionUtil
+        :param qr_login: QRLogin, 不检查登录时为 None
+        :param sku_id: 商品 id
+        :param seckill_num: 抢购数量
+        :param seckill_init_info: 已获取的秒杀初始化信息
+        :param seckill_order_data: 已生成的订单参数
+        :return:
+        """
+        self.session_util = session_util
+        self.qr_login = qr_login
 
-        self.sku_id = env_params.get('SKU_ID')
-        self.seckill_num = 2
-        self.seckill_init_info = dict()
+        self.settings = get_settings()
+        self.sku_id = sku_id
+        self.seckill_num = seckill_num
+        self.sku_settings = self.settings.for_sku(self.sku_id, self.seckill_num)
+        self.seckill_init_info = seckill_init_info if seckill_init_info is not None else dict()
         self.seckill_url = dict()
-        self.seckill_order_data = dict()
+        self.seckill_order_data = seckill_order_data if seckill_order_data is not None else dict()
+        self.submit_order_template = None
+        # 初始化信息中的 token 是否可以直接用于提交 (预热拿到的 token 在抢购时刻需要刷新)
+        self.seckill_token_fresh = False
+        self.order_id = None
+        self.total_money = None
+        self.pay_url = None
+        # 最近一次提交的结果码, 成功为 0, 无法解析结果时为 None
+        self.last_result_code = None
+        # 流水线模式下后台预取初始化信息, 只在抢购期间存在
+        self.prefetcher = None
+        # 常驻运行时共用的时钟同步器 (ClockSynchronizer), 为 None 时每次抢购重新同步
+        self.clock = None
         # self.timers = timer.timer
 
         self.session = self.session_util.get_session()
         self.user_agent = self.session_util.get_user_agent()
         self.nick_name = None
+        self.metadata = None
+
+    def metadata_cache(self):
+        """
+        当前账号的信息缓存
+        :return: MetadataCache, 未确定账号时为 None
+        """
+        metadata_file = self.session_util.metadata_file()
+        if metadata_file is None:
+            return None
+        if self.metadata is None or self.metadata.path != metadata_file:
+            self.metadata = MetadataCache(metadata_file)
+        return self.metadata
 
     def login_by_qrcode(self):
         """
@@ -301,8 +470,10 @@ class Seckill(object):
         self.qr_login.login_by_qr()
 
         if self.qr_login.is_login:
-            self.nick_name = self.get_username()
+            # 新登录的账号可能与本地缓存的不同, 不读取缓存
+            self.nick_name = self._get_username()
             self.session_util.save_cookies_to_local(self.nick_name)
+            self.metadata_cache().set('username', self.nick_name)
         else:
             raise SKException('二维码登陆失败...')
 
@@ -319,51 +490,194 @@ class Seckill(object):
             return func(self, *args, **kwargs)
         return new_func
 
+    def start_session_keeper(self, buy_time_ms):
+        """
+        等待抢购期间在后台定期验证登录状态, 配置 SESSION_KEEPER_ENABLED 关闭时不启动
+        :param buy_time_ms: 抢购时间戳(ms)
+        :return: SessionKeeper, 未启动时为 None
+        """
+        if not env_params.get('SESSION_KEEPER_ENABLED', True):
+            return None
+        keeper = SessionKeeper(self.qr_login, buy_time_ms)
+        keeper.start()
+        return keeper
+
     @check_login
-    def order(self):
+    def order(self, deadline=0):
         """
         预约
-        :return:
+        :param deadline: 最长重试时间(秒), 0 为直到预约成功
+        :return: 是否预约成功
         """
-        self._order()
+        return self._order(deadline)
 
     @check_login
     def buy(self):
         """
         抢购
+        等待抢购时间期间预热初始化信息, 到点后立即提交
+        :return: PurchaseResult
+        """
+        connection_manager = self.session_util.connection_manager
+        adjuster = Adjuster(clock=self.clock)
+        keeper = self.start_session_keeper(adjuster.buy_time_ms)
+        try:
+            # 保活请求可能在抢购时刻占用连接, 距离抢购时间不足一个保活间隔时停止保活
+            adjuster.start(warmup=self.warmup, quiesce=connection_manager.stop_keepalive,
+                           quiesce_lead_ms=connection_manager.keepalive_interval * 1000)
+        finally:
+            if keeper is not None:
+                keeper.stop()
+            connection_manager.stop_keepalive()
+        result = self._buy(PurchaseResult(buy_time_ms=adjuster.buy_time_ms, triggered_at_ms=time.time() * 1000.0))
+        logger.info(result.summary())
+        return result
+
+    def warmup(self):
+        """
+        预热: 建立并保活抢购相关域名的连接, 提前获取秒杀初始化信息, 生成除 token 外的订单参数
         :return:
         """
-        self._buy()
+        connection_manager = self.session_util.connection_manager
+        connection_manager.prewarm()
+        connection_manager.start_keepalive()
+        try:
+            self._refresh_seckill_init_info()
+            self.seckill_token_fresh = False
+            logger.info('预热完成, 已生成订单基本参数.')
+        except Exception as e:
+            logger.error(f"""预热失败, 抢购时将重新获取初始化信息. Error - {str(e)}""")
 
-    def buy_by_multi_process(self, work_count=5):
+    @check_login
+    def buy_by_multi_process(self, work_count=None):
         """
         多进程完成抢购
-        :param work_count:
-        :return:
+        预热时启动进程并传入 cookies 与初始化信息, 抢购时间到达后所有进程同时开始提交
+        :param work_count: 进程数
+        :return: 各进程的统计 [WorkerReport, ...]
         """
-        with ProcessPoolExecutor(work_count) as pool:
-            for i in range(work_count):
-                pool.submit(self.buy)
+        from maotai.common.worker import WorkerPool
+
+        connection_manager = self.session_util.connection_manager
+        pool = WorkerPool(self, work_count)
+
+        def warmup():
+            self.warmup()
+            pool.start()
+
+        def quiesce():
+            connection_manager.stop_keepalive()
+            pool.quiesce()
 
-    def _order(self):
+        adjuster = Adjuster(clock=self.clock)
+        keeper = self.start_session_keeper(adjuster.buy_time_ms)
+        try:
+            adjuster.start(warmup=warmup, quiesce=quiesce,
+                           quiesce_lead_ms=connection_manager.keepalive_interval * 1000)
+            pool.go()
+        except BaseException:
+            pool.stop()
+            raise
+        finally:
+            if keeper is not None:
+                keeper.stop()
+            connection_manager.stop_keepalive()
+        return pool.join()
+
+    def _order(self, deadline=0):
+        policy = RetryPolicy(deadline=deadline)
         while True:
             try:
                 self.make_order()
-                break
+                return True
             except Exception as e:
                 logger.error(f"""预约失败. Error - {str(e)}""")
-            wait_time()
+            delay = policy.backoff()
+            remaining = policy.remaining()
+            if remaining is not None and remaining <= delay:
+                logger.error(f"""预约失败, 已超过重试总时限 {deadline} 秒""")
+                return False
+            time.sleep(delay)
 
-    def _buy(self):
-        while True:
-            try:
-                # self.request_seckill_url()
-                while True:
+    def _buy(self, result=None):
+        """
+        按重试策略循环提交, 抢购成功 / 没有库存 / 超过总时限或提交次数上限后停止
+        :param result: 已记录触发时刻的 PurchaseResult
+        :return: PurchaseResult
+        """
+        if result is None:
+            result = PurchaseResult(triggered_at_ms=time.time() * 1000.0)
+        policy = RetryPolicy()
+        self.order_id = None
+        if env_params.get('PREFETCH_ENABLED'):
+            self.prefetcher = TokenPrefetcher(self)
+            self.prefetcher.start()
+        begin = time.perf_counter()
+        try:
+            while True:
+                error = None
+                attempt_begin = time.perf_counter()
+                try:
+                    # self.request_seckill_url()
                     # self.request_seckill_checkout_page()
                     self.submit_seckill_order()
-            except Exception as e:
-                logger.error(f"""抢购失败. Error - {str(e)}""")
-            wait_time()
+                except Exception as e:
+                    error = e
+                    logger.error(f"""抢购失败. Error - {str(e)}""")
+                result.latencies_ms.append((time.perf_counter() - attempt_begin) * 1000.0)
+                decision = self._retry_decision(policy, error)
+                if decision.action == STOP:
+                    return self._finish_purchase(result, decision.reason)
+                time.sleep(decision.delay)
+        finally:
+            result.attempts = len(result.latencies_ms)
+            result.elapsed_ms = (time.perf_counter() - begin) * 1000.0
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+                self.prefetcher = None
+            events.flush()
+            self.session_util.connection_manager.log_stats()
+            governor.log_stats()
+            tracer.summary()
+            tracer.flush()
+
+    def _finish_purchase(self, result, reason):
+        """
+        填充抢购结果
+        并发提交时最后一次的结果码可能来自其它请求, 以是否拿到订单号判断成功
+        :param result: PurchaseResult
+        :param reason: 停止原因
+        :return: PurchaseResult
+        """
+        result.reason = reason
+        result.success = self.order_id is not None
+        if result.success:
+            result.result_code = 0
+            result.order_id = self.order_id
+            result.total_money = self.total_money
+            result.pay_url = self.pay_url
+        else:
+            result.result_code = self.last_result_code
+        return result
+
+    def _retry_decision(self, policy, error=None):
+        """
+        按重试策略处理本次提交结果, 需要时作废初始化信息
+        :param policy: RetryPolicy
+        :param error: 提交时抛出的异常
+        :return: RetryDecision
+        """
+        decision = policy.decide(None if error else self.last_result_code, error)
+        if getattr(error, 'action', None) == REAUTH and self.qr_login is not None:
+            # 登录已失效, 常驻进程 / 状态输出据此提示重新登录
+            self.qr_login.is_login = False
+        if decision.action == STOP:
+            logger.info(f"""停止抢购: {decision.reason}""")
+        elif decision.action == REFRESH:
+            self._invalidate_seckill_init_info()
+        if decision.delay:
+            logger.info(f"""{decision.reason}, {decision.delay * 1000:.0f} ms 后重试""")
+        return decision
 
     def make_order(self):
         logger.info(f"""用户: {self.get_username()}""")
@@ -375,25 +689,30 @@ class Seckill(object):
         }
         headers = {
             'User-Agent': self.user_agent,
-            'Referer': env_params.get('YUSHOW_REFER').__str__().format(self.sku_id),
+            'Referer': self.sku_settings.yushow_refer,
         }
         resp = self.session.get(url=env_params.get('YUSHOW'), params=payload, headers=headers)
-        resp_json = parse_json(resp.text)
+        resp_json = parse_response(resp)
         reserve_url = resp_json.get('url')
 
-        while True:
-            try:
-                self.session.get(url='https:' + reserve_url)
-                logger.info('预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约')
-                # if global_config.getRaw('messenger', 'enable') == 'true':
-                #     success_message = "预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约"
-                #     send_wechat(success_message)
-                break
-            except Exception as e:
-                logger.error(f"""预约失败正在重试... {str(e)}""")
-            wait_time()
+        # 失败时抛出异常, 由 _order 按重试策略重试
+        self.session.get(url='https:' + reserve_url)
+        logger.info('预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约')
+        # if global_config.getRaw('messenger', 'enable') == 'true':
+        #     success_message = "预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约"
+        #     send_wechat(success_message)
 
     def get_username(self):
+        """
+        当前登陆用户的昵称, 优先读取缓存
+        :return:
+        """
+        metadata = self.metadata_cache()
+        if metadata is None:
+            return self._get_username()
+        return metadata.get_or_load('username', self._get_username)
+
+    def _get_username(self):
         """
         检索当前登陆用户的信息
         :return:
@@ -408,7 +727,7 @@ class Seckill(object):
         }
         resp = self.session.get(url=env_params.get('USER_INFO'), params=payload, headers=headers)
         try_count = 5
-        while not resp.text.startswith("jQuery"):
+        while not resp.content.startswith(b"jQuery"):
             try_count = try_count - 1
             if try_count > 0:
                 resp = self.session.get(url=env_params.get('USER_INFO'), params=payload, headers=headers)
@@ -417,17 +736,28 @@ class Seckill(object):
             wait_time()
         # 响应中包含了许多用户信息，现在在其中返回昵称
         # jQuery2381773({"imgUrl":"//storage.360buyimg.com/i.imageUpload/xxx.jpg","lastLoginTime":"","nickName":"xxx","plusStatus":"0","realName":"xxx","userLevel":x,"userScoreVO":{"accountScore":xx,"activityScore":xx,"consumptionScore":xxxxx,"default":false,"financeScore":xxx,"pin":"xxx","riskScore":x,"totalScore":xxxxx}})
-        return parse_json(resp.text).get('nickName')
+        return parse_response(resp).get('nickName')
 
     def get_sku_title(self):
         """
-        检索抢购商品的title
+        抢购商品的title, 优先读取缓存
+        :return:
+        """
+        metadata = self.metadata_cache()
+        if metadata is None:
+            return self._get_sku_title()
+        return metadata.get_or_load(f"""sku_title:{self.sku_id}""", self._get_sku_title)
+
+    def _get_sku_title(self):
+        """
+        检索抢购商品的title, 只读取到页面的 </title> 为止
         :return:
         """
-        resp = self.session.get(env_params.get('PRODUCT_INFO').__str__().format(self.sku_id)).content
-        x_data = etree.HTML(resp)
-        sku_title = x_data.xpath('/html/head/title/text()')
-        return sku_title[0]
+        resp = self.session.get(self.sku_settings.product_info_url, stream=True)
+        sku_title = read_title(resp)
+        if sku_title is None:
+            raise SKException(f"""商品页面中没有找到 title: {self.sku_settings.product_info_url}""")
+        return sku_title
 
     def get_seckill_url(self):
         """
@@ -445,11 +775,12 @@ class Seckill(object):
         headers = {
             'User-Agent': self.user_agent,
             'Host': 'itemko.jd.com',
-            'Referer': env_params.get('GET_SECKILL_LINK_REFER').__str__().format(self.sku_id),
+            'Referer': self.sku_settings.get_seckill_link_refer,
         }
         while True:
             resp = self.session.get(url=env_params.get('GET_SECKILL_LINK'), headers=headers, params=payload)
-            resp_json = parse_json(resp.text)
+            events.record('SECKILL_URL', resp.status_code)
+            resp_json = parse_response(resp)
             if resp_json.get('url'):
                 # https://divide.jd.com/user_routing?skuId=8654289&sn=c3f4ececd8461f0e4d7267e96a91e0e0&from=pc
                 router_url = 'https:' + resp_json.get('url')
@@ -473,7 +804,7 @@ class Seckill(object):
         headers = {
             'User-Agent': self.user_agent,
             'Host': 'marathon.jd.com',
-            'Referer': env_params.get('REQUEST_SECKILL_REFER').__str__().format(self.sku_id),
+            'Referer': self.sku_settings.request_seckill_refer,
         }
         self.session.get(url=self.seckill_url.get(self.sku_id), headers=headers, allow_redirects=False)
 
@@ -490,16 +821,15 @@ class Seckill(object):
         headers = {
             'User-Agent': self.user_agent,
             'Host': 'marathon.jd.com',
-            'Referer': env_params.get('REQUEST_SECKILL_CHECKOUT_REFER').__str__().format(self.sku_id),
+            'Referer': self.sku_settings.request_seckill_checkout_refer,
         }
         self.session.get(url=env_params.get('REQUEST_SECKILL_CHECKOUT'), params=payload, headers=headers, allow_redirects=False)
 
-    def _get_seckill_init_info(self):
+    def _seckill_init_request(self):
         """
-        获取秒杀初始化信息（包括：地址，发票，token）
-        :return: 初始化信息组成的dict
+        获取秒杀初始化信息的请求参数
+        :return: (请求体, headers)
         """
-        logger.info('获取秒杀初始化信息...')
         data = {
             'sku': self.sku_id,
             'num': self.seckill_num,
@@ -509,22 +839,40 @@ class Seckill(object):
             'User-Agent': self.user_agent,
             'Host': 'marathon.jd.com',
         }
-        resp = self.session.post(url=env_params.get('SECKILL_INIT'), data=data, headers=headers)
+        return data, headers
+
+    @staticmethod
+    def _parse_seckill_init_info(content):
+        """
+        解析秒杀初始化信息
+        :param content: 响应体 bytes
+        :return: 初始化信息组成的dict
+        """
         try:
-            resp_json = parse_json(resp.text)
-            return resp_json
+            return decode_json(content)
         except Exception:
-            raise SKException(f"""抢购失败，返回信息:{resp.text[0: 128]}""")
+            raise SKException(f"""抢购失败，返回信息:{preview(content)}""")
 
-    def _get_seckill_order_data(self):
+    def _get_seckill_init_info(self):
+        """
+        获取秒杀初始化信息（包括：地址，发票，token）
+        不跟随跳转, 登录失效时直接拿到跳转登录页的响应
+        :return: 初始化信息组成的dict
+        """
+        logger.info('获取秒杀初始化信息...')
+        data, headers = self._seckill_init_request()
+        resp = self.session.post(url=self.settings.seckill_init, data=data, headers=headers, allow_redirects=False)
+        events.record('SECKILL_INIT', resp.status_code)
+        check_response(resp)
+        return self._parse_seckill_init_info(resp.content)
+
+    def _get_seckill_order_data(self, init_info):
         """
         生成提交抢购订单所需的请求体参数
+        :param init_info: 秒杀初始化信息
         :return: 请求体参数组成的dict
         """
         logger.info('生成提交抢购订单所需参数...')
-        # 获取用户秒杀初始化信息
-        self.seckill_init_info[self.sku_id] = self._get_seckill_init_info()
-        init_info = self.seckill_init_info.get(self.sku_id)
         default_address = init_info['addressList'][0]  # 默认地址dict
         invoice_info = init_info.get('invoiceInfo', {})  # 默认发票信息dict, 有可能不返回
         token = init_info['token']
@@ -552,47 +900,83 @@ class Seckill(object):
             'invoicePhone': invoice_info.get('invoicePhone', ''),
             'invoicePhoneKey': invoice_info.get('invoicePhoneKey', ''),
             'invoice': 'true' if invoice_info else 'false',
-            'password': env_params.get('PAYMENT_PWD'),
+            'password': self.settings.payment_pwd,
             'codTimeType': 3,
             'paymentType': 4,
             'areaCode': '',
             'overseas': 0,
             'phone': '',
-            'eid': env_params.get('EID'),
-            'fp': env_params.get('FP'),
+            'eid': self.settings.eid,
+            'fp': self.settings.fp,
             'token': token,
             'pru': ''
         }
 
         return data
 
-    def submit_seckill_order(self):
+    def _refresh_seckill_init_info(self):
         """
-        提交抢购（秒杀）订单
-        :return: 抢购结果 True/False
+        获取秒杀初始化信息并更新订单参数
+        已有订单参数时只替换 token, 否则完整生成
+        :return:
+        """
+        self._apply_seckill_init_info(self._get_seckill_init_info())
+
+    def _apply_seckill_init_info(self, init_info):
+        """
+        使用新获取的秒杀初始化信息更新订单参数
+        :param init_info: 秒杀初始化信息
+        :return:
+        """
+        self.seckill_init_info[self.sku_id] = init_info
+        order_data = self.seckill_order_data.get(self.sku_id)
+        if order_data:
+            order_data['token'] = init_info['token']
+        else:
+            self.seckill_order_data[self.sku_id] = self._get_seckill_order_data(init_info)
+        self.seckill_token_fresh = True
+
+    def _invalidate_seckill_init_info(self):
+        """
+        初始化信息过期, 下次提交前完整重新获取
+        :return:
+        """
+        self.seckill_init_info.pop(self.sku_id, None)
+        self.seckill_order_data.pop(self.sku_id, None)
+        self.submit_order_template = None
+        self.seckill_token_fresh = False
+
+    def _submit_order_request(self):
+        """
+        提交抢购订单的请求参数
+        :return: (url 参数, headers)
         """
         payload = {
             'skuId': self.sku_id,
         }
-        try:
-            self.seckill_order_data[self.sku_id] = self._get_seckill_order_data()
-        except Exception as e:
-            logger.info(f"""抢购失败，无法获取生成订单的基本信息，Error -{str(e)}""")
-            return False
-
-        logger.info('提交抢购订单...')
         headers = {
             'User-Agent': self.user_agent,
             'Host': 'marathon.jd.com',
-            'Referer': env_params.get('SUBMIT_ORDER_REFER').__str__().format(self.sku_id, self.seckill_num, int(time.time())),
+            'Referer': self.sku_settings.submit_order_refer(int(time.time())),
         }
-        resp = self.session.post(url=env_params.get('SUBMIT_ORDER'), params=payload, data=self.seckill_order_data.get(self.sku_id), headers=headers)
+        return payload, headers
+
+    def _handle_submit_order_response(self, content):
+        """
+        处理提交抢购订单的返回信息
+        :param content: 响应体 bytes
+        :return: 抢购结果 True/False
+        """
+        self.last_result_code = None
         try:
-            resp_json = parse_json(resp.text)
+            resp_json = decode_json(content)
+            events.record('SUBMIT_RESULT', resp_json.get('resultCode'))
             if resp_json.get('success'):
+                self.last_result_code = 0
                 order_id = resp_json.get('orderId')
                 total_money = resp_json.get('totalMoney')
-                pay_url = 'https:' + resp_json.get('pcUrl')
+                pay_url = 'https:' + (resp_json.get('pcUrl') or '')
+                self.order_id, self.total_money, self.pay_url = order_id, total_money, pay_url
                 logger.info(f"""抢购成功，订单号:{order_id}, 总价:{total_money}, 电脑端付款链接:{pay_url}""")
                 # if global_config.getRaw('messenger', 'enable') == 'true':
                 #     success_message = "抢购成功，订单号:{}, 总价:{}, 电脑端付款链接:{}".format(order_id, total_money, pay_url)
@@ -600,12 +984,15 @@ class Seckill(object):
                 return True
             else:
                 logger.info(f"""抢购失败，返回信息:{resp_json}""")
+                self.last_result_code = resp_json.get('resultCode')
+                if self.last_result_code == SUBMIT_TOO_FAST:
+                    governor.server_throttled(self.settings.submit_order)
             # if global_config.getRaw('messenger', 'enable') == 'true':
             #     error_message = '抢购失败，返回信息:{}'.format(resp_json)
             #     send_wechat(error_message)
                 return False
         except Exception as e:
-            logger.info(f"""抢购失败，返回信息:{resp.text[0: 128]}. Error - {str(e)}""")
+            logger.info(f"""抢购失败，返回信息:{preview(content)}. Error - {str(e)}""")
             return False
         # 返回信息
         # 抢购失败：
@@ -615,3 +1002,48 @@ class Seckill(object):
         # 抢购成功：
         # {"appUrl":"xxxxx","orderId":820227xxxxx,"pcUrl":"xxxxx","resultCode":0,"skuId":0,"success":true,"totalMoney":"xxxxx"}
 
+    def _send_submit_order(self):
+        """
+        使用预先生成的请求模板提交订单, 订单参数重新生成后模板随之重建
+        :return: 响应
+        """
+        order_data = self.seckill_order_data[self.sku_id]
+        if self.submit_order_template is None:
+            payload, headers = self._submit_order_request()
+            self.submit_order_template = SubmitOrderTemplate(self.session, self.settings.submit_order, payload,
+                                                             headers, order_data, self.sku_settings)
+        template = self.submit_order_template
+        prepared = template.prepare(order_data['token'], int(time.time()), self.session.cookies)
+        return self.session.send(prepared, allow_redirects=False, **template.send_kwargs)
+
+    def submit_seckill_order(self):
+        """
+        提交抢购（秒杀）订单
+        :return: 抢购结果 True/False
+        """
+        self.last_result_code = None
+        try:
+            if not self.seckill_token_fresh and self.prefetcher is not None:
+                # 流水线模式: token 需要刷新 (REFRESH 或作废) 时取用一份预取的初始化信息,
+                # 90013 / 60017 等 token 仍然有效的结果码继续使用当前 token
+                init_info = self.prefetcher.take()
+                if init_info is None:
+                    raise SKException('等待预取的初始化信息超时')
+                self._apply_seckill_init_info(init_info)
+            elif not self.seckill_token_fresh:
+                self._refresh_seckill_init_info()
+        except UnusableResponse:
+            # 交给重试策略决定停止或退避
+            self._invalidate_seckill_init_info()
+            raise
+        except Exception as e:
+            self._invalidate_seckill_init_info()
+            logger.info(f"""抢购失败，无法获取生成订单的基本信息，Error -{str(e)}""")
+            return False
+
+        logger.info('提交抢购订单...')
+        events.record('SUBMIT')
+        resp = self._send_submit_order()
+        events.record('SUBMIT_RESPONSE', resp.status_code)
+        check_response(resp)
+        return self._handle_submit_order_response(resp.content)
@@ -0,0 +1,119 @@
+import time
+import threading
+
+from maotai.common.config import get_settings
+from maotai.logger.logutil import logger
+
+
+class SessionKeeper(object):
+    """
+    等待抢购期间在后台定期验证登录状态, 验证有效后重新保存 cookies (更新验证时间及服务端下发的新 cookies)
+    距离抢购时间 alert_seconds 以内发现需要重新登录时持续告警,
+    quiet_seconds 以内不再验证, 抢购窗口中不会出现登录相关的请求
+    """
+
+    def __init__(self, qr_login, buy_time_ms, interval=None, alert_seconds=None, quiet_seconds=None):
+        """
+        :param qr_login: QRLogin, 使用其会话验证登录状态
+        :param buy_time_ms: 抢购时间戳(ms)
+        :param interval: 验证间隔(秒)
+        :param alert_seconds: 距离抢购时间多少秒以内登录失效时告警
+        :param quiet_seconds: 距离抢购时间多少秒以内停止验证
+        """
+        settings = get_settings()
+        self.qr_login = qr_login
+        self.session_util = qr_login.session_util
+        self.buy_time = buy_time_ms / 1000.0
+        self.interval = interval if interval is not None else settings.session_keeper_interval
+        self.alert_seconds = alert_seconds if alert_seconds is not None else settings.session_alert_seconds
+        self.quiet_seconds = quiet_seconds if quiet_seconds is not None else settings.session_keeper_quiet_seconds
+        self.checks = 0
+        self.failures = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _remaining(self):
+        """
+        距离抢购时间的秒数
+        :return:
+        """
+        return self.buy_time - time.time()
+
+    def _next_delay(self):
+        """
+        距离下次验证的等待时间, 以 cookies 上次验证有效的时间为起点
+        :return:
+        """
+        record = self.session_util.cookie_record
+        verified_at = record.verified_at if record is not None and record.verified_at else 0
+        return max(0.0, verified_at + self.interval - time.time())
+
+    def check(self):
+        """
+        验证一次登录状态, 有效时重新保存 cookies
+        :return: 是否有效
+        """
+        self.checks += 1
+        self.qr_login.refresh_login_status()
+        if self.qr_login.is_login:
+            if self.session_util.account:
+                self.session_util.save_cookies_to_local(self.session_util.account)
+            logger.info(f"""登录状态有效, 距离抢购时间 {self._remaining():.0f} 秒.""")
+            return True
+        self.failures += 1
+        self._alert()
+        return False
+
+    def _alert(self):
+        """
+        登录失效告警, 临近抢购时间时响铃并醒目输出
+        :return:
+        """
+        remaining = self._remaining()
+        if remaining > self.alert_seconds:
+            logger.error(f"""登录已失效, 距离抢购时间 {remaining:.0f} 秒, 请在抢购前重新扫码登录.""")
+            return
+        print('\a', end='', flush=True)
+        logger.critical('!' * 60)
+        logger.critical(f"""登录已失效, 距离抢购时间只剩 {remaining:.0f} 秒!!! 请立即重新扫码登录, 否则本次抢购会失败.""")
+        logger.critical('!' * 60)
+
+    def _run(self):
+        delay = self._next_delay()
+        while True:
+            # 进入静默期前做最后一次验证
+            delay = min(delay, max(0.0, self._remaining() - self.quiet_seconds))
+            if self._stop_event.wait(delay) or self._remaining() <= self.quiet_seconds:
+                break
+            try:
+                valid = self.check()
+            except Exception as e:
+                valid = False
+                logger.error(f"""验证登录状态失败. Error - {str(e)}""")
+            # 失效后缩短间隔, 临近抢购时间时更频繁地告警
+            delay = self.interval if valid else min(self.interval, 30)
+        logger.info(f"""停止验证登录状态: 共验证 {self.checks} 次, 失效 {self.failures} 次.""")
+
+    def start(self):
+        """
+        启动后台验证线程, 距离抢购时间已不足静默期时不启动
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self._remaining() <= self.quiet_seconds:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='SessionKeeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止后台验证线程
+        :return:
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+from maotai.common.config import env_params
+from maotai.common.util import percentile
+from maotai.logger.logutil import logger
+
+# 单个请求的阶段: 排队(含取连接) / 建立连接(DNS+TCP+TLS) / 首字节 / 读取响应体
+PHASES = ('queue', 'connect', 'ttfb', 'body')
+
+_local = threading.local()
+
+
+def current_record():
+    """
+    当前线程正在记录的请求
+    :return: 请求记录 dict, 未开启追踪时为 None
+    """
+    return getattr(_local, 'record', None)
+
+
+class Tracer(object):
+    """
+    请求追踪: 以单调时钟记录每个请求各阶段的耗时, 按配置中的接口名称标记所属步骤,
+    结束后写入 JSONL 或 Chrome trace ( .json ) 文件
+    """
+
+    def __init__(self, trace_file=None):
+        # 未指定追踪文件时在第一次 begin() 时读取配置 TRACE_FILE, 导入模块时不加载配置
+        self.trace_file = trace_file
+        self.enabled = bool(trace_file) if trace_file is not None else None
+        self.records = []
+        self.lock = threading.Lock()
+        self._steps = None
+
+    def step_of(self, url):
+        """
+        根据配置中的接口地址得到请求所属的步骤, 如 SECKILL_INIT / SUBMIT_ORDER
+        :param url: 请求地址
+        :return: 步骤名称
+        """
+        if self._steps is None:
+            steps = {}
+            for key, value in env_params.items():
+                if isinstance(value, str) and '://' in value and not key.endswith('_REFER'):
+                    parts = urlsplit(value)
+                    steps.setdefault(parts.netloc + parts.path, key)
+            self._steps = steps
+        parts = urlsplit(url)
+        return self._steps.get(parts.netloc + parts.path, parts.path)
+
+    def _resolve(self):
+        """
+        读取配置 TRACE_FILE 决定是否开启追踪
+        :return:
+        """
+        self.trace_file = env_params.get('TRACE_FILE')
+        self.enabled = bool(self.trace_file)
+
+    def begin(self, request):
+        """
+        开始记录一个请求
+        :param request: PreparedRequest
+        :return: 请求记录, 未开启追踪时为 None
+        """
+        if self.enabled is None:
+            self._resolve()
+        if not self.enabled:
+            return None
+        return {
+            'step': self.step_of(request.url),
+            'method': request.method,
+            'url': request.url.split('?', 1)[0],
+            'thread': threading.get_ident(),
+            'begin_ns': time.monotonic_ns(),
+            'adapter_ns': 0,
+            'queue_ns': 0,
+            'connect_ns': 0,
+            'headers_ns': 0,
+            'end_ns': 0,
+            'new_connection': False,
+            'status': None,
+        }
+
+    def end(self, record, response):
+        """
+        结束记录一个请求
+        :param record: 请求记录
+        :param response: 响应, 请求异常时为 None
+        :return:
+        """
+        record['end_ns'] = time.monotonic_ns()
+        record['headers_ns'] = record['headers_ns'] or record['end_ns']
+        record['status'] = response.status_code if response is not None else None
+        with self.lock:
+            self.records.append(record)
+
+    @staticmethod
+    def phases(record):
+        """
+        计算各阶段耗时
+        :param record: 请求记录
+        :return: {阶段: 耗时 ms}
+        """
+        adapter_ns = record['adapter_ns'] or record['begin_ns']
+        queue_ns = adapter_ns - record['begin_ns'] + record['queue_ns']
+        ttfb_ns = record['headers_ns'] - adapter_ns - record['queue_ns'] - record['connect_ns']
+        return {
+            'queue': queue_ns / 1e6,
+            'connect': record['connect_ns'] / 1e6,
+            'ttfb': ttfb_ns / 1e6,
+            'body': (record['end_ns'] - record['headers_ns']) / 1e6,
+            'total': (record['end_ns'] - record['begin_ns']) / 1e6,
+        }
+
+    def _chrome_events(self, records, pid):
+        """
+        转换为 Chrome trace 事件, 每个请求一个事件, 其下按顺序排列各阶段
+        :param records: 请求记录
+        :param pid: 进程号
+        :return:
+        """
+        events = []
+        for record in records:
+            phases = self.phases(record)
+            ts = record['begin_ns'] / 1000.0
+            base = {'pid': pid, 'tid': record['thread'], 'ph': 'X'}
+            events.append(dict(base, name=record['step'], ts=ts, dur=phases['total'] * 1000.0,
+                               args={'url': record['url'], 'status': record['status'],
+                                     'new_connection': record['new_connection']}))
+            for phase in PHASES:
+                dur = phases[phase] * 1000.0
+                events.append(dict(base, name=phase, ts=ts, dur=dur))
+                ts += dur
+        return events
+
+    def flush(self):
+        """
+        把已记录的请求写入追踪文件
+        :return:
+        """
+        if not self.enabled or not self.records:
+            return
+        with self.lock:
+            records, self.records = self.records, []
+        directory = os.path.dirname(self.trace_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if self.trace_file.endswith('.json'):
+            events = self._chrome_events(records, os.getpid())
+            with open(self.trace_file, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': events}, f)
+        else:
+            with open(self.trace_file, 'a', encoding='utf-8') as f:
+                for record in records:
+                    line = dict(step=record['step'], method=record['method'], url=record['url'],
+                                status=record['status'], begin_ns=record['begin_ns'],
+                                new_connection=record['new_connection'])
+                    line.update({k: round(v, 3) for k, v in self.phases(record).items()})
+                    f.write(json.dumps(line) + '\n')
+        logger.info(f"""请求追踪已写入: {self.trace_file}""")
+
+    def summary(self):
+        """
+        按步骤输出各阶段耗时统计
+        :return:
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            records = list(self.records)
+        steps = {}
+        for record in records:
+            steps.setdefault(record['step'], []).append(self.phases(record))
+        lines = [f"""{'步骤':<28}{'n':>5}{'新建连接':>6}{'queue':>9}{'connect':>9}{'ttfb':>9}{'body':>9}"""
+                 f"""{'p50':>9}{'p90':>9}"""]
+        for step, phases in steps.items():
+            count = len(phases)
+            new_connections = sum(1 for r in records if r['step'] == step and r['new_connection'])
+            avg = {k: sum(p[k] for p in phases) / count for k in PHASES}
+            totals = [p['total'] for p in phases]
+            lines.append(f"""{step:<28}{count:>5}{new_connections:>8}{avg['queue']:>9.2f}{avg['connect']:>9.2f}"""
+                         f"""{avg['ttfb']:>9.2f}{avg['body']:>9.2f}{percentile(totals, 50):>9.2f}"""
+                         f"""{percentile(totals, 90):>9.2f}""")
+        logger.info('请求耗时统计 (ms):\n' + '\n'.join(lines))
+
+
+tracer = Tracer()
+
+
+class TracingSession(requests.Session):
+    """
+    开启追踪时记录每个请求的各阶段耗时
+    """
+
+    def send(self, request, **kwargs):
+        record = tracer.begin(request)
+        if record is None:
+            return super().send(request, **kwargs)
+        # 跟随重定向时会嵌套调用 send
+        previous = current_record()
+        _local.record = record
+        response = None
+        try:
+            response = super().send(request, **kwargs)
+            return response
+        finally:
+            _local.record = previous
+            tracer.end(record, response)
@@ -1,3 +1,4 @@
+import os
 import random
 import time
 import json
@@ -669,3 +670,35 @@ def parse_json(s):
     begin = s.find('{')
     end = s.rfind('}') + 1
     return json.loads(s[begin:end])
+
+
+def percentile(values, p):
+    """
+    线性插值计算百分位数
+    :param values: 数据
+    :param p: 百分位 0 - 100
+    :return:
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    k = (len(ordered) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def write_atomic(path, content):
+    """
+    原子写入文本文件: 写入临时文件后替换, 避免中断时留下不完整的文件
+    :param path: 文件
+    :param content: 内容
+    :return:
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_file = f"""{path}.tmp"""
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_file, path)
@@ -0,0 +1,176 @@
+import time
+import multiprocessing
+from collections import namedtuple
+
+from maotai.common.config import env_params, get_settings
+from maotai.common.governor import governor
+from maotai.common.seckill import SessionUtil, Seckill
+from maotai.common.retry import RetryPolicy, STOP
+from maotai.logger.logutil import logger, events, configure_logger
+
+# 单个抢购进程的统计: 进程编号, 提交次数, 每次提交耗时(ms), 抢到的订单号 (未抢到为 None)
+WorkerReport = namedtuple('WorkerReport', ['worker_id', 'attempts', 'latencies_ms', 'order_id'])
+
+
+class WorkerState(object):
+    """
+    父进程显式传给抢购进程的状态: cookies 以及预热得到的初始化信息 / 订单参数
+    """
+
+    def __init__(self, seckill):
+        self.cookies = seckill.session_util.get_cookies().copy()
+        self.user_agent = seckill.user_agent
+        self.sku_id = seckill.sku_id
+        self.seckill_num = seckill.seckill_num
+        self.seckill_init_info = dict(seckill.seckill_init_info)
+        self.seckill_order_data = {k: dict(v) for k, v in seckill.seckill_order_data.items()}
+
+
+class SeckillWorker(Seckill):
+    """
+    抢购进程中使用的 Seckill, 直接使用父进程传来的状态, 不再检查登录
+    """
+
+    def __init__(self, state):
+        session_util = SessionUtil()
+        session_util.user_agent = state.user_agent
+        session_util.session.headers = session_util.get_headers()
+        session_util.set_cookies(state.cookies)
+        self._init_state(session_util, None, state.sku_id, state.seckill_num,
+                         seckill_init_info=state.seckill_init_info, seckill_order_data=state.seckill_order_data)
+
+
+def run_worker(worker_id, state, quiet_event, go_event, stop_event, order_id, result_queue, timeout, work_count=1):
+    """
+    抢购进程入口: 预热连接后等待开始信号, 按重试策略循环提交直到任一进程抢购成功或停止
+    :param worker_id: 进程编号
+    :param state: WorkerState
+    :param quiet_event: 静默信号, 临近抢购时间时停止连接保活
+    :param go_event: 开始信号
+    :param stop_event: 停止信号, 任一进程抢购成功后设置
+    :param order_id: 共享的订单号, 第一个抢购成功的进程写入
+    :param result_queue: 返回 WorkerReport
+    :param timeout: 开始后最长抢购时间(秒)
+    :param work_count: 抢购进程数, 各进程平分 RATE_LIMITS 的持续速率, 总速率不超过配置
+    :return:
+    """
+    configure_logger(env_params)
+    governor.set_share(1.0 / work_count)
+    worker = SeckillWorker(state)
+    connection_manager = worker.session_util.connection_manager
+    connection_manager.prewarm()
+    connection_manager.start_keepalive()
+    quiet_event.wait()
+    connection_manager.stop_keepalive()
+    go_event.wait()
+
+    attempts = 0
+    latencies_ms = []
+    policy = RetryPolicy(deadline=timeout)
+    while not stop_event.is_set():
+        attempts += 1
+        begin = time.perf_counter()
+        error = None
+        try:
+            success = worker.submit_seckill_order()
+        except Exception as e:
+            success, error = False, e
+            logger.error(f"""抢购进程 {worker_id} 抢购失败. Error - {str(e)}""")
+        latencies_ms.append((time.perf_counter() - begin) * 1000.0)
+        if success:
+            with order_id.get_lock():
+                if not order_id.value:
+                    order_id.value = int(worker.order_id)
+            stop_event.set()
+            break
+        decision = worker._retry_decision(policy, error)
+        if decision.action == STOP or stop_event.wait(decision.delay):
+            break
+    connection_manager.log_stats()
+    events.flush()
+    result_queue.put(WorkerReport(worker_id, attempts, latencies_ms, worker.order_id))
+
+
+class WorkerPool(object):
+    """
+    多进程抢购: 预热阶段启动进程并建立连接, 抢购时间到达后统一开始,
+    任一进程抢购成功后广播订单号并停止其它进程
+    """
+
+    def __init__(self, seckill, work_count=None, timeout=None):
+        settings = get_settings()
+        self.seckill = seckill
+        self.work_count = work_count if work_count is not None else settings.multi_process_workers
+        self.timeout = timeout if timeout is not None else settings.multi_process_timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.quiet_event = self.context.Event()
+        self.go_event = self.context.Event()
+        self.stop_event = self.context.Event()
+        self.order_id = self.context.Value('q', 0)
+        self.result_queue = self.context.Queue()
+        self.processes = []
+
+    def start(self):
+        """
+        启动抢购进程, 进程预热后等待开始信号
+        :return:
+        """
+        state = WorkerState(self.seckill)
+        for worker_id in range(self.work_count):
+            process = self.context.Process(target=run_worker, name=f"""SeckillWorker-{worker_id}""",
+                                           args=(worker_id, state, self.quiet_event, self.go_event, self.stop_event,
+                                                 self.order_id, self.result_queue, self.timeout, self.work_count))
+            process.start()
+            self.processes.append(process)
+        logger.info(f"""已启动 {self.work_count} 个抢购进程""")
+
+    def quiesce(self):
+        """
+        发出静默信号, 各进程停止连接保活, 抢购时不再有保活请求占用连接
+        :return:
+        """
+        self.quiet_event.set()
+
+    def go(self):
+        """
+        发出开始信号
+        :return:
+        """
+        if not self.processes:
+            self.start()
+        self.quiet_event.set()
+        self.go_event.set()
+
+    def stop(self):
+        """
+        通知所有进程停止
+        :return:
+        """
+        self.stop_event.set()
+        self.quiet_event.set()
+        self.go_event.set()
+
+    def join(self):
+        """
+        等待所有进程结束并收集统计
+        :return: [WorkerReport, ...]
+        """
+        reports = []
+        for _ in self.processes:
+            try:
+                reports.append(self.result_queue.get(timeout=self.timeout + 30))
+            except Exception as e:
+                logger.error(f"""收集抢购进程结果失败. Error - {str(e)}""")
+                break
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for report in sorted(reports, key=lambda r: r.worker_id):
+            latencies = report.latencies_ms
+            avg = sum(latencies) / len(latencies) if latencies else 0
+            logger.info(f"""抢购进程 {report.worker_id}: 提交 {report.attempts} 次, 平均耗时 {avg:.1f} ms, """
+                        f"""订单号 {report.order_id}""")
+        if self.order_id.value:
+            logger.info(f"""抢购成功, 订单号: {self.order_id.value}""")
+        return reports
@@ -0,0 +1,43 @@
+import sys
+import json
+import signal
+import argparse
+
+from maotai.logger.logutil import logger, configure_logger
+from maotai.common.config import env_params
+from maotai.common.exception import SKException
+
+
+def main():
+    parser = argparse.ArgumentParser(description='京东茅台抢购常驻进程')
+    parser.add_argument('command', nargs='*',
+                        help='不带命令时启动常驻进程; status / stop / trigger order|buy 发送给运行中的常驻进程')
+    parser.add_argument('--socket', help='控制 socket 路径, 默认读取配置 DAEMON_SOCKET')
+    args = parser.parse_args()
+
+    from maotai.common.scheduler import SeckillScheduler, send_command
+    if args.command:
+        reply = send_command(args.command, args.socket)
+        print(json.dumps(reply, ensure_ascii=False, indent=2))
+        sys.exit(0 if reply.get('ok') else 1)
+
+    configure_logger(env_params)
+    # kill 时与 Ctrl+C 一样退出, 清理 socket 文件
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if env_params.get('DAEMON_BUY_MODE') == 'async':
+        from maotai.common.async_seckill import AsyncSeckill
+        seckill = AsyncSeckill()
+    else:
+        from maotai.common.seckill import Seckill
+        seckill = Seckill()
+    try:
+        SeckillScheduler(seckill, socket_path=args.socket).run()
+    except KeyboardInterrupt:
+        logger.info('收到退出信号.')
+    except SKException as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,20 @@
+import time
+import queue
+import atexit
+import struct
 import logging
+import itertools
+import threading
 import logging.handlers
 
 LOG_FILE = "running.log"
 logger = logging.getLogger()
 
+# 异步模式下使用的格式: 不包含调用位置 (文件/函数/行号), 记录日志时无需查找调用栈
+LEAN_FORMAT = '%(asctime)s - %(threadName)s - %(levelname)s: %(message)s'
+
+_listener = None
+
 
 def setup_logger():
     logger.setLevel(logging.INFO)
@@ -17,4 +28,151 @@ def setup_logger():
     logger.addHandler(file_handler)
 
 
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    只把日志记录放入队列, 格式化与输出都在后台线程中完成
+    (QueueHandler 默认会在调用线程中先格式化一次)
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_async_logger():
+    """
+    异步日志: 根 logger 只保留一个入队的 handler, 原有的控制台 / 文件 handler
+    改用精简格式后由后台线程输出, 同时关闭调用位置与进程信息的采集
+    :return:
+    """
+    global _listener
+    if _listener is not None:
+        return
+    handlers = list(logger.handlers)
+    formatter = logging.Formatter(LEAN_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.removeHandler(handler)
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_async_logger)
+
+
+def stop_async_logger():
+    """
+    输出队列中剩余的日志并停止后台线程
+    :return:
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class EventRing(object):
+    """
+    定长二进制环形缓冲区, 抢购期间只写入 (时刻, 事件, 数值) 三元组, 结束后统一输出到日志
+    写满后覆盖最早的事件
+    """
+    RECORD = struct.Struct('<qHq')
+
+    def __init__(self, capacity=0):
+        self.names = []
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        """
+        重新分配缓冲区并清空已记录的事件
+        :param capacity: 最多保留的事件数, 0 为关闭
+        :return:
+        """
+        self.capacity = capacity
+        self.enabled = capacity > 0
+        self.buffer = bytearray(self.RECORD.size * capacity)
+        self.counter = itertools.count()
+        self.written = 0
+
+    def record(self, event, value=0):
+        """
+        记录一个事件
+        :param event: 事件名称
+        :param value: 整数值, 如状态码 / 返回码
+        :return:
+        """
+        if not self.enabled:
+            return
+        code = self.codes.get(event)
+        if code is None:
+            code = self._register(event)
+        # next(count) 在 GIL 下是原子的, 多线程写入时各自占用不同的位置
+        index = next(self.counter)
+        self.RECORD.pack_into(self.buffer, (index % self.capacity) * self.RECORD.size,
+                              time.monotonic_ns(), code, int(value or 0))
+        self.written = index + 1
+
+    def _register(self, event):
+        """
+        为新的事件名称分配编号
+        :param event: 事件名称
+        :return: 编号
+        """
+        with self.lock:
+            code = self.codes.get(event)
+            if code is None:
+                code = len(self.names)
+                self.names.append(event)
+                self.codes[event] = code
+            return code
+
+    def events(self):
+        """
+        按时间顺序读出缓冲区中的事件
+        :return: [(monotonic_ns, 事件名称, 数值), ...]
+        """
+        written = self.written
+        result = []
+        for index in range(max(0, written - self.capacity), written):
+            ts, code, value = self.RECORD.unpack_from(self.buffer, (index % self.capacity) * self.RECORD.size)
+            result.append((ts, self.names[code], value))
+        result.sort(key=lambda event: event[0])
+        return result
+
+    def flush(self):
+        """
+        把缓冲区中的事件输出到日志并清空
+        :return:
+        """
+        if not self.enabled or not self.written:
+            return
+        events = self.events()
+        dropped = self.written - len(events)
+        self.resize(self.capacity)
+        first = events[0][0]
+        lines = [f"""{(ts - first) / 1000.0:>12.1f} us  {name:<16}{value}""" for ts, name, value in events]
+        if dropped:
+            lines.append(f"""(已覆盖最早的 {dropped} 个事件)""")
+        logger.info(f"""抢购事件 ({len(events)} 个):\n""" + '\n'.join(lines))
+
+
+events = EventRing()
+
+
+def configure_logger(params):
+    """
+    按配置开启异步日志与事件缓冲区
+    :param params: 配置, 读取 LOG_QUEUE / LOG_EVENT_RING
+    :return:
+    """
+    if params.get('LOG_QUEUE'):
+        setup_async_logger()
+    events.resize(params.get('LOG_EVENT_RING') or 0)
+
+
 setup_logger()
@@ -1,5 +1,6 @@
 import sys
-from maotai.logger.logutil import logger
+from maotai.logger.logutil import logger, configure_logger
+from maotai.common.config import env_params
 from maotai.common.seckill import Seckill
 
 if __name__ == '__main__':
@@ -9,16 +10,24 @@ if __name__ == '__main__':
     功能列表：                                                                                
      1. 预约茅台 
      2. 抢购茅台
+     3. 抢购茅台 (异步并发)
+     4. 抢购茅台 (多进程)
     """
     print(a)
+    configure_logger(env_params)
     choice = input('请选择: ')
 
-    seckill = Seckill()
+    if choice == '3':
+        from maotai.common.async_seckill import AsyncSeckill
+        seckill = AsyncSeckill()
+    else:
+        seckill = Seckill()
     if choice == '1':
         seckill.order()
-    elif choice == '2':
-        # seckill.buy_by_multi_process()
+    elif choice in ('2', '3'):
         seckill.buy()
+    elif choice == '4':
+        seckill.buy_by_multi_process()
     else:
         logger.info('目前没有提供此功能...')
         sys.exit(1)